@@ -0,0 +1,36 @@
+"""
+Measures the time needed to import the models in a new interpreter, and lists the slowest imported modules.
+
+Usage : python benchmarks/bench_import.py [runs_count]
+"""
+import subprocess
+import sys
+from statistics import median
+
+
+def import_times(code="import vosfactures.models"):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" lines on stderr
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines()[1:]:
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def main(runs):
+    measures = [import_times() for _ in range(runs)]
+    total = median(times["vosfactures.models"] for times in measures)
+    print("import vosfactures.models : {:.1f} ms (median of {} runs)".format(total / 1000, runs))
+
+    # The modules imported by the interpreter itself on startup are ignored
+    startup_modules = import_times("pass")
+    last = {module: time for module, time in measures[-1].items() if module not in startup_modules}
+    print("Slowest imported modules :")
+    for module in sorted(last, key=last.get, reverse=True)[:10]:
+        print("  {:<40} {:>8.1f} ms".format(module, last[module] / 1000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,99 @@
+"""
+Micro-benchmarks of the hydration of the models and of the assignment of their attributes, with the compiled schema
+and with the previous implementation (reflection on each key and each assignment).
+
+Usage : python benchmarks/bench_models.py [records_count]
+"""
+import gc
+import sys
+from time import perf_counter
+
+from vosfactures.models import Invoice, ObjectIsDeletedError
+
+# A complete invoice, as returned by the API (with some keys that aren't fields of the model)
+RECORD = {
+    'id': 1, 'user_id': 1, 'app': None, 'number': '2017-09', 'place': None, 'sell_date': '2017-04-07',
+    'payment_type': None, 'price_net': '797.73', 'price_gross': '952.5', 'price_tax': '154.77', 'currency': 'EUR',
+    'status': 'issued', 'description': None, 'seller_name': 'Facture de test', 'seller_tax_no': '123456789',
+    'seller_street': '', 'seller_post_code': '', 'seller_city': '', 'seller_country': '', 'seller_email': '',
+    'seller_phone': '', 'seller_bank': '', 'seller_bank_account': '', 'buyer_name': 'Travaux.com, test',
+    'buyer_tax_no': '987654321', 'buyer_post_code': '78001', 'buyer_city': 'Stazunis',
+    'buyer_street': 'Av Georges Fitgéralde Kentucky', 'buyer_first_name': 'Sophie', 'buyer_last_name': 'Garnier',
+    'buyer_country': 'FR', 'buyer_email': 'c321@fhdj.com', 'buyer_phone': '123456789',
+    'created_at': '2017-04-07T17:07:53.000+02:00', 'updated_at': '2017-04-07T17:07:53.000+02:00',
+    'token': 'NP4WXnGNQDu3y2Y4DxUi', 'kind': 'vat', 'pattern': 'nr', 'pattern_nr': 2017, 'client_id': 1,
+    'payment_to': '2017-04-08', 'paid': '0.0', 'lang': 'fr', 'issue_date': '2017-04-07', 'department_id': 1,
+    'buyer_note': '', 'product_cache': 'test, Guide ', 'discount': '0.0', 'show_discount': False, 'sent_time': None,
+    'paid_date': None, 'issue_year': 2017, 'invoice_id': None, 'invoice_template_id': 2413, 'income': True,
+    'from_api': True, 'exchange_rate': '1.0', 'delivery_date': '2017-04-07', 'transaction_date': '2017-04-07',
+    'positions': [{'product_id': 1, 'quantity': 3}],
+}
+
+
+class ReflectiveInvoice(Invoice):
+    """
+    An invoice assigned like before the compiled schema : each key is checked with hasattr(), and each assignment goes
+    through the checks of __setattr__().
+    """
+    _assigning_data = False
+
+    def _set_data(self, **data):
+        tmp = self._assigning_data
+        self._assigning_data = True
+        for key, value in data.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+
+        self._assigning_data = tmp
+
+    def __setattr__(self, key, value):
+        if self._is_deleted:
+            raise ObjectIsDeletedError("This object doesn't exist anymore")
+
+        if not self._assigning_data:
+            if key in self._auto_data:
+                raise Exception("The following properties are set automatically and can't be edited : {}".format(
+                    self._auto_data))
+
+            if not key.startswith('_') and key not in self._updated_fields:
+                self._updated_fields = self._updated_fields + [key]
+
+        object.__setattr__(self, key, value)
+
+
+def reflective_hydrate(record):
+    instance = ReflectiveInvoice.__new__(ReflectiveInvoice)
+    instance._set_data(**record)
+    return instance
+
+
+def measure(label, func, count):
+    # Like timeit, the garbage collector is disabled to get stable measures
+    gc.disable()
+    start = perf_counter()
+    func()
+    duration = perf_counter() - start
+    gc.enable()
+    print("{:<40} {:>8.3f}s  {:>10.0f} records/s".format(label, duration, count / duration))
+
+
+def assign(instances):
+    for instance in instances:
+        instance.title = "New title"
+        instance.status = "paid"
+
+
+def main(count):
+    records = [dict(RECORD, id=i) for i in range(count)]
+
+    measure("hydration (reflection)", lambda: [reflective_hydrate(r) for r in records], count)
+    measure("hydration (compiled schema)", lambda: [Invoice._hydrate(r) for r in records], count)
+
+    reflective_instances = [reflective_hydrate(r) for r in records]
+    instances = [Invoice._hydrate(r) for r in records]
+    measure("attribute assignment (reflection)", lambda: assign(reflective_instances), count)
+    measure("attribute assignment (compiled schema)", lambda: assign(instances), count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
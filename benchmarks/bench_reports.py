@@ -0,0 +1,33 @@
+"""
+Measures the aggregation of invoices by client and month, with and without NumPy.
+
+Usage : python benchmarks/bench_reports.py [invoices_count]
+"""
+import random
+import sys
+from time import perf_counter
+
+from vosfactures.reports import aggregate
+
+
+def iter_invoices(count):
+    # Generated on the fly, like the pages of the API would be
+    generator = random.Random(0)
+    prices = ["{:.2f}".format(generator.uniform(1, 5000)) for _ in range(5000)]
+    for i in range(count):
+        yield {'id': i, 'client_id': i % 1000, 'issue_date': '2017-{:02d}-15'.format(i % 12 + 1), 'kind': 'vat',
+               'status': 'paid', 'price_net': prices[i % 5000], 'price_gross': prices[(i * 7) % 5000],
+               'paid': '0,00'}
+
+
+def main(count):
+    for use_numpy in (False, True):
+        start = perf_counter()
+        report = aggregate(iter_invoices(count), group_by=('client', 'month'), use_numpy=use_numpy)
+        duration = perf_counter() - start
+        print("{:<15} {} groups, {:>8.3f}s  {:>10.0f} invoices/s".format(
+            "NumPy" if use_numpy else "Python", len(report), duration, count / duration))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
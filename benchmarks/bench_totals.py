@@ -0,0 +1,34 @@
+"""
+Compares the computation of the totals of many quotes one by one and in batch.
+
+Usage : python benchmarks/bench_totals.py [quotes_count]
+"""
+import random
+import sys
+from time import perf_counter
+
+from vosfactures.totals import compute_totals, compute_totals_batch
+
+
+def get_quotes(count):
+    generator = random.Random(0)
+    return [[{'price_net': "{:.2f}".format(generator.uniform(1, 1000)), 'quantity': generator.randint(1, 10),
+              'tax': generator.choice(['20', '10', '5.5'])} for _ in range(generator.randint(1, 10))]
+            for _ in range(count)]
+
+
+def measure(label, func, count):
+    start = perf_counter()
+    func()
+    duration = perf_counter() - start
+    print("{:<30} {:>8.3f}s  {:>10.0f} quotes/s".format(label, duration, count / duration))
+
+
+def main(count):
+    quotes = get_quotes(count)
+    measure("one by one", lambda: [compute_totals(positions) for positions in quotes], count)
+    measure("batch", lambda: compute_totals_batch(quotes), count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
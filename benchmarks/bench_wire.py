@@ -0,0 +1,77 @@
+"""
+Measures the bytes sent and received on the wire by a workload of large invoices (long descriptions, many positions)
+against the fake API of vosfactures.loadtest, with the previous transport (token in a JSON body for every query,
+uncompressed responses) and with the current one, with and without the compression of the request bodies.
+
+Usage : python benchmarks/bench_wire.py [invoices_count]
+"""
+import json
+import sys
+from urllib.parse import urlencode
+
+from vosfactures import settings, utils
+from vosfactures.loadtest import FakeApi
+from vosfactures.models import Invoice
+
+
+def legacy_query(json_page=None, action=None, instance_id=None, method="GET", params=None, **kwargs):
+    # The transport before the compression : every query has a JSON body holding the token
+    if instance_id is None:
+        url = "https://{}/{}.json".format(settings.HOST, json_page)
+    else:
+        url = "https://{}/{}/{}.json".format(settings.HOST, json_page, instance_id)
+    if params:
+        url = "{}?{}".format(url, urlencode(params))
+
+    headers = {'Accept': 'application/json', 'Content-Type': 'application/json', 'Accept-Encoding': 'identity'}
+    data = json.dumps({"api_token": settings.API_TOKEN, action: kwargs})
+    response = utils.get_session().request(method, url=url, headers=headers, data=data)
+    return response.json()
+
+
+def run_workload(count):
+    positions = [{'product_id': i, 'quantity': i % 3 + 1, 'name': "Prestation de service n°{}".format(i),
+                  'description': "Intervention sur site, déplacement et fournitures inclus. " * 3}
+                 for i in range(1, 31)]
+    invoices = [Invoice.create(title="Facture {}".format(i), issue_date="2017-01-27", department_id=1, client_id=1,
+                               description_long="Conditions générales de vente et de paiement. " * 40,
+                               description_footer="Pénalités de retard : trois fois le taux d'intérêt légal. " * 10,
+                               positions=positions)
+                for i in range(count)]
+    list(Invoice.iter_raw(per_page=25))
+    for invoice in invoices:
+        Invoice.get(invoice.id)
+    for invoice in invoices:
+        invoice.delete()
+
+
+def measure(count, legacy=False, compress_requests=False):
+    utils.COMPRESS_REQUESTS = compress_requests
+    original_query = utils.query
+    if legacy:
+        utils.query = legacy_query
+    try:
+        with FakeApi() as fake_api:
+            run_workload(count)
+    finally:
+        utils.query = original_query
+        utils.COMPRESS_REQUESTS = False
+    return fake_api.request_bytes, fake_api.response_bytes
+
+
+def main(count):
+    settings.HOST = "bench.vosfactures.fr"
+    settings.API_TOKEN = "abcdefghijklmnopqrst"
+
+    baseline = None
+    for name, kwargs in (("Previous transport", dict(legacy=True)), ("Compressed responses", {}),
+                         ("+ compressed requests", dict(compress_requests=True))):
+        sent, received = measure(count, **kwargs)
+        total = sent + received
+        baseline = baseline or total
+        print("{:<22} sent {:>10} B  received {:>10} B  total {:>10} B ({:>5.1%})".format(
+            name, sent, received, total, total / baseline))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
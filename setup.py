@@ -20,6 +20,12 @@ setup(
     url="https://github.com/briceparent/py_vosfactures",
     packages=['vosfactures'],
     long_description=read('README.md'),
+    entry_points={
+        'console_scripts': ['vosfactures = vosfactures.cli:main'],
+    },
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Topic :: Utilities",
@@ -0,0 +1,201 @@
+import os
+import shutil
+import struct
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from tempfile import SpooledTemporaryFile
+from time import monotonic
+
+from vosfactures.utils import CHUNK_SIZE
+
+# The downloaded PDFs are kept in memory up to this size, then in a temporary file until they are written to the ZIP
+SPOOL_SIZE = 1024 * 1024
+
+
+class ExportStats:
+    def __init__(self):
+        self.exported = 0
+        self.skipped = 0
+        self.failed = []  # (invoice, exception) tuples
+        self.bytes = 0
+        self.started_at = monotonic()
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started_at
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.
+
+    @property
+    def files_per_second(self):
+        return self.exported / self.elapsed if self.elapsed else 0.
+
+    def __str__(self):
+        return "{} exported, {} skipped, {} failed, {:.1f} MB in {:.1f}s ({:.2f} MB/s, {:.1f} files/s)".format(
+            self.exported, self.skipped, len(self.failed), self.bytes / 1e6, self.elapsed,
+            self.bytes_per_second / 1e6, self.files_per_second)
+
+
+def get_entry_name(invoice):
+    return "{}.pdf".format(invoice.id)
+
+
+def get_journal_path(dest_zip):
+    return "{}.journal".format(dest_zip)
+
+
+def recover(dest_zip):
+    """
+    Restores the archive as it was at its last checkpoint, if an export was interrupted while writing into it.
+
+    Appending to a ZIP archive overwrites its central directory, so before each segment of entries is written, the
+    position and the content of the central directory are saved in a journal (see open_segment()). The journal is
+    removed once the segment is complete.
+    """
+    journal_path = get_journal_path(dest_zip)
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, 'rb') as journal:
+        offset, = struct.unpack('<q', journal.read(8))
+        central_directory = journal.read()
+
+    if offset < 0:
+        # The archive didn't exist before the interrupted segment
+        if os.path.exists(dest_zip):
+            os.remove(dest_zip)
+    else:
+        with open(dest_zip, 'r+b') as archive:
+            archive.truncate(offset)
+            archive.seek(offset)
+            archive.write(central_directory)
+            archive.flush()
+            os.fsync(archive.fileno())
+    os.remove(journal_path)
+
+
+def open_segment(dest_zip, compression):
+    """
+    Opens the archive to append some entries, after having saved what's needed to undo them in its journal.
+    """
+    if os.path.exists(dest_zip):
+        with zipfile.ZipFile(dest_zip) as archive:
+            offset = archive.start_dir
+        with open(dest_zip, 'rb') as archive:
+            archive.seek(offset)
+            central_directory = archive.read()
+    else:
+        offset, central_directory = -1, b''
+
+    # The journal is written completely before it's used
+    journal_path = get_journal_path(dest_zip)
+    with open(journal_path + ".part", 'wb') as journal:
+        journal.write(struct.pack('<q', offset))
+        journal.write(central_directory)
+        journal.flush()
+        os.fsync(journal.fileno())
+    os.replace(journal_path + ".part", journal_path)
+
+    return zipfile.ZipFile(dest_zip, mode='a', compression=compression)
+
+
+def close_segment(archive, dest_zip):
+    archive.close()
+    with open(dest_zip, 'rb') as archive_file:
+        os.fsync(archive_file.fileno())
+    os.remove(get_journal_path(dest_zip))
+
+
+def export_pdfs(invoices, dest_zip, workers=4, progress=None, compression=zipfile.ZIP_STORED,
+                checkpoint_every=100, chunk_size=CHUNK_SIZE):
+    """
+    Downloads the PDFs of the given invoices concurrently and writes them into a ZIP archive, one after the other and
+    chunk by chunk. The invoices already present in the archive are skipped, so that an interrupted export can be
+    resumed by calling this function again, even if the process was killed (the entries written since the last
+    checkpoint are then lost). The failed downloads are counted in the stats instead of stopping the
+    export.
+    :param invoices: an iterable of invoices, consumed lazily (like Invoice.iter_list())
+    :param dest_zip: the path of the ZIP archive, created if it doesn't exist
+    :param workers: the maximum number of concurrent downloads
+    :param progress: a callable, called with the ExportStats after each invoice
+    :param compression: the zipfile compression method. PDFs are already compressed, so they are stored by default.
+    :param checkpoint_every: the number of entries after which the archive is closed then reopened, so that an abrupt
+    termination of the process loses at most this number of entries
+    :return: the ExportStats of the export
+    """
+    stats = ExportStats()
+    done = set()
+    recover(dest_zip)
+    if os.path.exists(dest_zip):
+        with zipfile.ZipFile(dest_zip) as archive:
+            done.update(archive.namelist())
+
+    def fetch(invoice):
+        pdf = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            invoice.download_pdf(pdf, chunk_size=chunk_size)
+        except BaseException:
+            pdf.close()
+            raise
+        pdf.seek(0)
+        return pdf
+
+    archive = open_segment(dest_zip, compression)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        invoices = iter(invoices)
+        exhausted = False
+        while pending or not exhausted:
+            # Only a few downloads are queued at a time, to keep the memory and the temporary files bounded
+            while not exhausted and len(pending) < workers * 2:
+                invoice = next(invoices, None)
+                if invoice is None:
+                    exhausted = True
+                elif get_entry_name(invoice) in done:
+                    stats.skipped += 1
+                    if progress is not None:
+                        progress(stats)
+                else:
+                    pending[executor.submit(fetch, invoice)] = invoice
+
+            if not pending:
+                continue
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                invoice = pending.pop(future)
+                try:
+                    pdf = future.result()
+                except Exception as e:
+                    stats.failed.append((invoice, e))
+                else:
+                    with pdf, archive.open(get_entry_name(invoice), mode='w') as entry:
+                        shutil.copyfileobj(pdf, entry, chunk_size)
+                        stats.bytes += pdf.tell()
+                    done.add(get_entry_name(invoice))
+                    stats.exported += 1
+
+                    if checkpoint_every and stats.exported % checkpoint_every == 0:
+                        close_segment(archive, dest_zip)
+                        # Not closed again below if it can't be reopened
+                        archive = None
+                        archive = open_segment(dest_zip, compression)
+
+                if progress is not None:
+                    progress(stats)
+    finally:
+        # Whatever happens (even a KeyboardInterrupt), the archive is left in a readable state
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+        # The downloads that finished but weren't written keep their temporary file open
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+        if archive is not None:
+            close_segment(archive, dest_zip)
+
+    return stats
@@ -0,0 +1,92 @@
+from threading import RLock
+
+
+class ModelCache:
+    """
+    In-process store of model instances, indexed by model name and id. It is used to resolve the relationships between
+    the models (like invoice.client) without querying the API for each object.
+
+    The instances that aren't in memory can be read from some sources (like a vosfactures.snapshot.Snapshot), unless
+    they have been invalidated since.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._instances = {}
+        self._sources = []
+        self._invalidated = {}  # The invalidated ids by model name, or None when the whole model is invalidated
+
+    def get(self, model, instance_id):
+        with self._lock:
+            instance = self._instances.get(model.__name__, {}).get(instance_id)
+            if instance is not None or not self._sources:
+                return instance
+
+            invalidated = self._invalidated.get(model.__name__, ())
+            if invalidated is None or instance_id in invalidated:
+                return None
+            sources = list(self._sources)
+
+        for source in sources:
+            instance = source.get(model, instance_id)
+            if instance is not None:
+                with self._lock:
+                    # Unless it has been changed in the meantime
+                    return self._instances.setdefault(model.__name__, {}).setdefault(instance_id, instance)
+        return None
+
+    def set(self, instance):
+        with self._lock:
+            self._instances.setdefault(instance.__class__.__name__, {})[instance.id] = instance
+            invalidated = self._invalidated.get(instance.__class__.__name__)
+            if invalidated:
+                invalidated.discard(instance.id)
+
+    def add_source(self, source):
+        """
+        Adds a source of instances, an object with a get(model, instance_id) method returning an instance or None.
+        """
+        with self._lock:
+            self._sources.append(source)
+
+    def remove_source(self, source):
+        with self._lock:
+            if source in self._sources:
+                self._sources.remove(source)
+            if not self._sources:
+                self._invalidated = {}
+
+    def invalidate(self, model, instance_id=None):
+        """
+        Removes an instance from the cache, or every instance of the given model if no id is given.
+        """
+        with self._lock:
+            if instance_id is None:
+                self._instances.pop(model.__name__, None)
+            else:
+                self._instances.get(model.__name__, {}).pop(instance_id, None)
+
+            if not self._sources:
+                return
+            # The sources can't be used anymore for these instances
+            if instance_id is None:
+                self._invalidated[model.__name__] = None
+            else:
+                invalidated = self._invalidated.setdefault(model.__name__, set())
+                if invalidated is not None:
+                    invalidated.add(instance_id)
+
+    def clear(self):
+        """
+        Removes all the instances from memory. The sources still can't be used for the invalidated instances, as they
+        would be read again from them.
+        """
+        with self._lock:
+            self._instances = {}
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(instances) for instances in self._instances.values())
+
+
+default_cache = ModelCache()
@@ -0,0 +1,323 @@
+"""
+The "vosfactures" command.
+
+    vosfactures export invoices --format parquet --since 2017-01-01 --output invoices.parquet
+    vosfactures loadtest --concurrency 8 --rate 20 --latency-profile latencies.json
+    vosfactures snapshot catalog.sqlite
+
+The exported elements are streamed from the pages of the list queries into the output file by batches of rows, without
+building any instance, so that the memory used doesn't depend on the number of exported elements.
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import date
+from time import monotonic
+
+from vosfactures.models import Client, Department, Invoice, Product
+
+EXPORT_MODELS = {
+    'invoices': Invoice,
+    'clients': Client,
+    'products': Product,
+    'departments': Department,
+}
+FORMATS = ('jsonl', 'csv', 'parquet')
+BATCH_SIZE = 1000
+
+
+class ExportProgress:
+    """
+    Prints the throughput of an export to a stream (stderr by default), at most once per interval.
+    """
+
+    def __init__(self, stream=None, interval=1.):
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.records = 0
+        self.started_at = self._printed_at = monotonic()
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started_at
+
+    @property
+    def records_per_second(self):
+        return self.records / self.elapsed if self.elapsed else 0.
+
+    def update(self, records):
+        self.records += records
+        if monotonic() - self._printed_at >= self.interval:
+            self._printed_at = monotonic()
+            self.stream.write("{}\n".format(self))
+
+    def __str__(self):
+        return "{} records in {:.1f}s ({:.0f} records/s)".format(self.records, self.elapsed, self.records_per_second)
+
+
+def get_value(value):
+    # The nested values (like the positions of the invoices) are kept as JSON in the flat formats
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return value
+
+
+class JsonlWriter:
+    def __init__(self, output, fields):
+        self.output = output
+
+    def write(self, records):
+        self.output.write("".join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n" for record in records))
+
+    def close(self):
+        pass
+
+
+class CsvWriter:
+    def __init__(self, output, fields):
+        self.writer = csv.DictWriter(output, fieldnames=fields, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, records):
+        self.writer.writerows({key: get_value(value) for key, value in record.items()} for record in records)
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """
+    Writes each batch as a row group. The type of each column is inferred from the first batch (the columns without any
+    value being strings), and kept for the following ones.
+    """
+
+    def __init__(self, output, fields):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("The parquet format requires pyarrow (pip install pyarrow)")
+
+        self.pyarrow = pyarrow
+        self.output = output
+        self.fields = fields
+        self.schema = None
+        self.writer = None
+
+    def write(self, records):
+        pyarrow = self.pyarrow
+        columns = [[get_value(record.get(field)) for record in records] for field in self.fields]
+
+        if self.schema is None:
+            schema_fields = []
+            for field, values in zip(self.fields, columns):
+                column_type = pyarrow.array(values).type
+                if pyarrow.types.is_null(column_type):
+                    column_type = pyarrow.string()
+                schema_fields.append(pyarrow.field(field, column_type))
+            self.schema = pyarrow.schema(schema_fields)
+            self.writer = pyarrow.parquet.ParquetWriter(self.output, self.schema)
+
+        arrays = []
+        for schema_field, values in zip(self.schema, columns):
+            if pyarrow.types.is_string(schema_field.type):
+                values = [value if value is None else str(value) for value in values]
+            arrays.append(pyarrow.array(values, type=schema_field.type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {
+    'jsonl': JsonlWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def iter_batches(pages, batch_size):
+    batch = []
+    for page in pages:
+        batch.extend(page)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+def can_filter_since(model):
+    # The invoices are filtered by their issue date, and the other elements by their update date, if they have one
+    return model is Invoice or 'updated_at' in model._fields
+
+
+def export(model, output, output_format='jsonl', since=None, params=None, workers=4, per_page=None,
+           batch_size=BATCH_SIZE, progress=None):
+    """
+    Writes all the elements of a model into a file.
+    :param model: a model class, like Invoice
+    :param output: a file object (binary for the parquet format, text otherwise)
+    :param output_format: "jsonl", "csv" or "parquet"
+    :param since: a date (YYYY-MM-DD) : only the invoices issued since this date, or the other elements updated since
+    then, are exported
+    :param params: some other filters of the list query
+    :param workers: the number of pages queried concurrently
+    :param progress: an ExportProgress
+    :return: the number of exported elements
+    :raise ValueError: if since is given for a model that can't be filtered by date
+    """
+    if since and not can_filter_since(model):
+        raise ValueError("The {} elements can't be filtered by date".format(model.__name__))
+
+    params = dict(params or {})
+    if since and model is Invoice:
+        params.update(period="more", date_from=since, date_to=date.today().isoformat())
+
+    pages = model._iter_raw_pages(per_page, workers, **params)
+    if since and model is not Invoice:
+        # The other list queries can't be filtered by date
+        pages = ([element for element in page if (element.get('updated_at') or '') >= since] for page in pages)
+
+    # The elements are written with the fields of the model, the flat formats needing a fixed set of columns
+    writer = WRITERS[output_format](output, list(model._field_names))
+    count = 0
+    try:
+        for batch in iter_batches(pages, batch_size):
+            writer.write(batch)
+            count += len(batch)
+            if progress is not None:
+                progress.update(len(batch))
+    finally:
+        writer.close()
+    return count
+
+
+def parse_filter(text):
+    key, separator, value = text.partition('=')
+    if not separator or not key:
+        raise argparse.ArgumentTypeError("The filters should be written KEY=VALUE")
+    return key, value
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="vosfactures", description="Tools for the VosFactures API")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    export_parser = subparsers.add_parser('export', help="Export all the elements of a model into a file")
+    export_parser.add_argument('model', choices=sorted(EXPORT_MODELS))
+    export_parser.add_argument('--format', dest='output_format', choices=FORMATS, default='jsonl')
+    export_parser.add_argument('--output', '-o', default='-', help="The output file (the standard output by default)")
+    export_parser.add_argument('--since', help="Only the invoices issued since this date (YYYY-MM-DD), or the other "
+                                               "elements updated since then")
+    export_parser.add_argument('--filter', dest='filters', type=parse_filter, action='append', default=[],
+                               help="A filter of the list query, like period=last_year (can be repeated)")
+    export_parser.add_argument('--workers', type=int, default=4, help="The number of pages queried concurrently")
+    export_parser.add_argument('--per-page', type=int, default=None)
+    export_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    export_parser.add_argument('--quiet', '-q', action='store_true', help="Don't print the throughput")
+
+    loadtest_parser = subparsers.add_parser('loadtest', help="Replay a scenario concurrently and report the latencies")
+    loadtest_parser.add_argument('--scenario', default='invoicing', help="The name of a scenario of "
+                                                                         "vosfactures.loadtest.SCENARIOS")
+    loadtest_parser.add_argument('--iterations', type=int, default=None,
+                                 help="The number of times the scenario is run (100 if there is no duration)")
+    loadtest_parser.add_argument('--duration', type=float, default=None, help="The duration of the test in seconds")
+    loadtest_parser.add_argument('--concurrency', type=int, default=4)
+    loadtest_parser.add_argument('--rate', type=float, default=None, help="The maximum number of calls per second")
+    loadtest_parser.add_argument('--live', action='store_true',
+                                 help="Run against the API of the settings (creating and deleting real objects) "
+                                      "instead of a fake one")
+    loadtest_parser.add_argument('--latency', type=float, default=0.,
+                                 help="The latency of the fake API in seconds")
+    loadtest_parser.add_argument('--latency-profile', help="A JSON file of recorded latencies for the fake API")
+    loadtest_parser.add_argument('--error-rate', type=float, default=0., help="The error rate of the fake API")
+    loadtest_parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    snapshot_parser = subparsers.add_parser('snapshot', help="Dump the products, clients and departments into a "
+                                                             "snapshot file, to be loaded by the workers")
+    snapshot_parser.add_argument('output', help="The path of the snapshot file")
+    snapshot_parser.add_argument('--workers', type=int, default=4, help="The number of pages queried concurrently")
+    return parser
+
+
+def run_export(args):
+    model = EXPORT_MODELS[args.model]
+    if args.since and not can_filter_since(model):
+        raise SystemExit("The {} can't be exported --since a date, as they have no update date".format(args.model))
+
+    binary = args.output_format == 'parquet'
+    if args.output == '-':
+        output = sys.stdout.buffer if binary else sys.stdout
+    elif binary:
+        output = open(args.output, 'wb')
+    else:
+        output = open(args.output, 'w', newline='', encoding='utf-8')
+
+    progress = None if args.quiet else ExportProgress()
+    try:
+        export(model, output, args.output_format, since=args.since, params=dict(args.filters), workers=args.workers,
+               per_page=args.per_page, batch_size=args.batch_size, progress=progress)
+    finally:
+        if output not in (sys.stdout, sys.stdout.buffer):
+            output.close()
+
+    if progress is not None:
+        sys.stderr.write("Done : {}\n".format(progress))
+
+
+def run_loadtest(args):
+    from vosfactures.loadtest import SCENARIOS, FakeApi, LatencyProfile, run_load_test
+
+    if args.scenario not in SCENARIOS:
+        raise SystemExit('Unknown scenario "{}" (available : {})'.format(args.scenario, ", ".join(sorted(SCENARIOS))))
+
+    iterations = args.iterations
+    if iterations is None and args.duration is None:
+        iterations = 100
+
+    fake_api = None
+    if not args.live:
+        latency = LatencyProfile.from_file(args.latency_profile) if args.latency_profile else args.latency
+        fake_api = FakeApi(latency_profile=latency, error_rate=args.error_rate)
+        fake_api.install()
+
+    try:
+        report = run_load_test(SCENARIOS[args.scenario], iterations=iterations, duration=args.duration,
+                               concurrency=args.concurrency, rate=args.rate)
+    finally:
+        if fake_api is not None:
+            fake_api.uninstall()
+
+    if args.json:
+        sys.stdout.write(json.dumps(report.as_dict(), indent=2) + "\n")
+    else:
+        sys.stdout.write("{}\n".format(report))
+
+
+def run_snapshot(args):
+    from vosfactures.snapshot import dump_snapshot
+
+    start = monotonic()
+    counts = dump_snapshot(args.output, workers=args.workers)
+    sys.stderr.write("{} written in {:.1f}s\n".format(
+        ", ".join("{} {}".format(count, name) for name, count in counts.items()), monotonic() - start))
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command == 'export':
+        run_export(args)
+    elif args.command == 'loadtest':
+        run_loadtest(args)
+    elif args.command == 'snapshot':
+        run_snapshot(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
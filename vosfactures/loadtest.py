@@ -0,0 +1,387 @@
+"""
+A load-testing driver for the workflows built on the models : it replays a scenario (by default, creating products, a
+client and an invoice, changing its status then deleting everything) with a number of concurrent workers and an
+optional rate limit, and reports the latency, throughput and error rate of each command of each model.
+
+The scenarios can be run against the API, or against FakeApi, a fake of the API answering from memory inside the
+process, optionally with the latencies of a recorded profile.
+"""
+import gzip
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from itertools import count
+from math import ceil
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from urllib.parse import parse_qsl, urlsplit
+
+from vosfactures import settings, utils
+from vosfactures.models import Client, Invoice, Product, Status
+
+
+class LatencyProfile:
+    """
+    The latencies of the fake API, by "METHOD resource" (like "POST invoices"), "*" being used for the other requests.
+    Each latency is either a number of seconds, or a list of recorded latencies from which one is picked at random.
+    """
+
+    def __init__(self, latencies=None, seed=None):
+        self.latencies = dict(latencies or {})
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    @classmethod
+    def from_file(cls, path, seed=None):
+        """
+        Reads a profile from a JSON file, like {"POST invoices": [0.21, 0.35, 0.28], "*": 0.1}.
+        """
+        with open(path) as profile_file:
+            return cls(json.load(profile_file), seed=seed)
+
+    def get_latency(self, method, resource):
+        latency = self.latencies.get("{} {}".format(method, resource), self.latencies.get("*", 0.))
+        if isinstance(latency, (list, tuple)):
+            with self._lock:
+                return self._random.choice(latency) if latency else 0.
+        return latency
+
+
+def get_head_size(first_line, headers):
+    return len(first_line) + sum(len(key) + len(value) + 4 for key, value in headers.items()) + 4
+
+
+class FakeApi:
+    """
+    An in-memory fake of the API, mounted on the HTTP session of the queries (see utils.get_session()) in place of the
+    network. It handles the create, get, list, update, delete and change_status queries of every resource.
+    """
+
+    def __init__(self, latency_profile=None, error_rate=0., seed=None):
+        """
+        :param latency_profile: a LatencyProfile, or a number of seconds for every request
+        :param error_rate: the probability of answering a request with a 500 error
+        """
+        if not isinstance(latency_profile, LatencyProfile):
+            latency_profile = LatencyProfile({"*": latency_profile or 0.})
+        self.latency_profile = latency_profile
+        self.error_rate = error_rate
+        self.requests_count = 0
+        # The sizes of the requests and responses as they would be sent over HTTP/1.1, compressed when it's accepted
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self._random = random.Random(seed)
+        self._objects = {}  # The objects of each resource, by id
+        self._last_id = 0
+        self._lock = Lock()
+        self._prefix = None
+
+    def install(self):
+        self._prefix = "https://{}/".format(settings.HOST)
+        utils.get_session().mount(self._prefix, self)
+
+    def uninstall(self):
+        if self._prefix is not None:
+            utils.get_session().adapters.pop(self._prefix, None)
+            self._prefix = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    def send(self, request, **kwargs):
+        # The interface of the transport adapters of requests
+        url = urlsplit(request.url)
+        parts = url.path.strip('/').rsplit('.', 1)[0].split('/')
+        resource, instance_id, action = parts[0], None, None
+        if len(parts) > 1:
+            instance_id = int(parts[1]) if parts[1].isdigit() else parts[1]
+        if len(parts) > 2:
+            action = parts[2]
+
+        data = {}
+        body = request.body or b''
+        if body:
+            if request.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            body = json.loads(body)
+            data = next((value for key, value in body.items() if key != 'api_token'), None) or {}
+
+        with self._lock:
+            self.requests_count += 1
+            self.request_bytes += len(request.body or b'') + get_head_size(
+                "{} {} HTTP/1.1".format(request.method, request.path_url), request.headers)
+            failed = self.error_rate and self._random.random() < self.error_rate
+
+        sleep(self.latency_profile.get_latency(request.method, resource))
+        if failed:
+            status, content = 500, {"code": "error", "message": "Fake error"}
+        else:
+            with self._lock:
+                status, content = self._answer(request.method, resource, instance_id, action, data,
+                                               dict(parse_qsl(url.query)))
+                # Serialized while holding the lock, as the stored objects can be modified by the other threads
+                content = json.dumps(content).encode()
+
+        response = self._build_response(request, status, content)
+        # The content is given decoded, like the adapters of requests do, but counted as it would be sent
+        wire_content = response.content
+        if "gzip" in request.headers.get('Accept-Encoding', ''):
+            wire_content = gzip.compress(wire_content, compresslevel=6)
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Length'] = str(len(wire_content))
+        with self._lock:
+            self.response_bytes += len(wire_content) + get_head_size("HTTP/1.1 {} OK".format(status), response.headers)
+        return response
+
+    def close(self):
+        pass
+
+    def _answer(self, method, resource, instance_id, action, data, params):
+        objects = self._objects.setdefault(resource, {})
+
+        if instance_id is None and method == "GET":
+            page, per_page = int(params.get('page', 1)), int(params.get('per_page', 100))
+            elements = sorted(objects.values(), key=lambda element: element['id'])
+            return 200, elements[(page - 1) * per_page:page * per_page]
+
+        if instance_id is None and method == "POST":
+            self._last_id += 1
+            now = datetime.now().isoformat()
+            element = objects[self._last_id] = dict(data, id=self._last_id, created_at=now, updated_at=now)
+            return 201, element
+
+        element = objects.get(instance_id)
+        if element is None:
+            return 404, {"code": "error", "message": "Not found"}
+
+        if action == "change_status" and method == "POST":
+            element['status'] = params.get('status')
+            return 200, {"code": "ok", "message": "Status changed"}
+        if method == "GET":
+            return 200, element
+        if method == "PUT":
+            element.update(data, updated_at=datetime.now().isoformat())
+            return 200, element
+        if method == "DELETE":
+            del objects[instance_id]
+            return 200, {"code": "ok", "message": "Deleted"}
+
+        return 404, {"code": "error", "message": "Unknown query"}
+
+    @staticmethod
+    def _build_response(request, status, content):
+        response = utils.get_requests().models.Response()
+        response.status_code = status
+        response._content = content if isinstance(content, bytes) else json.dumps(content).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class RateLimiter:
+    """
+    Spaces out the calls made by all the threads so that they don't exceed a number of calls per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1. / rate
+        self._next_call_at = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = monotonic()
+            call_at = max(now, self._next_call_at)
+            self._next_call_at = call_at + self.interval
+        if call_at > now:
+            sleep(call_at - now)
+
+
+def get_percentile(sorted_values, percentile):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.
+    rank = ceil(percentile / 100. * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class CommandStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def error_rate(self):
+        return self.errors / self.count if self.count else 0.
+
+    def get_percentile(self, percentile):
+        return get_percentile(sorted(self.latencies), percentile)
+
+
+class LoadTestReport:
+    def __init__(self):
+        self.commands = {}  # CommandStats by (model name, command)
+        self.scenarios = 0
+        self.failed_scenarios = 0
+        self.elapsed = 0.
+        self._lock = Lock()
+
+    def record(self, model, command, latency, failed=False):
+        with self._lock:
+            stats = self.commands.get((model, command))
+            if stats is None:
+                stats = self.commands[(model, command)] = CommandStats()
+            stats.latencies.append(latency)
+            stats.errors += failed
+
+    def get_throughput(self, model, command):
+        return self.commands[(model, command)].count / self.elapsed if self.elapsed else 0.
+
+    def as_dict(self):
+        return {
+            "{}.{}".format(model, command): dict(
+                count=stats.count, errors=stats.errors, error_rate=stats.error_rate,
+                throughput=self.get_throughput(model, command), p50=stats.get_percentile(50),
+                p95=stats.get_percentile(95), p99=stats.get_percentile(99))
+            for (model, command), stats in self.commands.items()
+        }
+
+    def __str__(self):
+        lines = ["{:<24} {:>7} {:>7} {:>9} {:>9} {:>9} {:>10}".format(
+            "Command", "Count", "Errors", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Calls/s")]
+        for name, stats in sorted(self.as_dict().items()):
+            lines.append("{:<24} {:>7} {:>6.1%} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f}".format(
+                name, stats['count'], stats['error_rate'], stats['p50'] * 1000, stats['p95'] * 1000,
+                stats['p99'] * 1000, stats['throughput']))
+        lines.append("{} scenarios ({} failed) in {:.2f}s".format(self.scenarios, self.failed_scenarios, self.elapsed))
+        return "\n".join(lines)
+
+
+class ScenarioRunner:
+    """
+    Given to the scenarios to make their calls : run(model, command, function, *args, **kwargs) calls the function
+    (waiting for the rate limiter first), measures it, and returns its result.
+    """
+
+    def __init__(self, report, rate_limiter=None):
+        self.report = report
+        self.rate_limiter = rate_limiter
+
+    def __call__(self, model, command, function, *args, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.report.record(model.__name__, command, perf_counter() - start, failed=True)
+            raise
+        self.report.record(model.__name__, command, perf_counter() - start)
+        return result
+
+
+def invoicing_scenario(run, index, products_count=2, department_id=1):
+    """
+    Creates some products and a client, invoices them, marks the invoice as paid, then deletes everything. If a call
+    fails, the objects already created are still deleted.
+    :param run: the ScenarioRunner making the calls
+    :param index: the number of the iteration
+    """
+    created = []
+    completed = False
+    try:
+        for i in range(products_count):
+            created.append(run(Product, 'create', Product.create, name="Load test {}-{}".format(index, i),
+                               price_net="10.00", tax=20))
+        products = list(created)
+        client = run(Client, 'create', Client.create, name="Load test {}".format(index))
+        created.append(client)
+        invoice = run(Invoice, 'create', Invoice.create, title="Load test {}".format(index),
+                      issue_date=date.today().isoformat(), department_id=department_id, client_id=client.id,
+                      positions=[{'product_id': product.id, 'quantity': 1} for product in products])
+        created.append(invoice)
+        run(Invoice, 'set_status', invoice.set_status, Status.paid)
+        completed = True
+    finally:
+        # The invoice first, then the client and the products it references. The error of a failed call is kept over
+        # the ones of the deletions.
+        delete_all(run, reversed(created), raise_error=completed)
+
+
+def delete_all(run, instances, raise_error=True):
+    """
+    Deletes some instances through the ScenarioRunner. A failed deletion doesn't stop the following ones.
+    :param raise_error: True to raise the first error once all the deletions have been tried
+    """
+    first_error = None
+    for instance in instances:
+        try:
+            run(instance.__class__, 'delete', instance.delete)
+        except Exception as e:
+            first_error = first_error or e
+
+    if first_error is not None and raise_error:
+        raise first_error
+
+
+SCENARIOS = {
+    'invoicing': invoicing_scenario,
+}
+
+
+def run_load_test(scenario=invoicing_scenario, iterations=None, duration=None, concurrency=4, rate=None):
+    """
+    Runs a scenario repeatedly, from concurrent workers, until it has been run a number of times or for some time.
+    A failed call ends its iteration of the scenario, and is counted as an error of its command.
+    :param scenario: a callable receiving a ScenarioRunner and the number of the iteration (see invoicing_scenario())
+    :param iterations: the total number of iterations
+    :param duration: the maximum duration of the test in seconds (no new iteration is started after it)
+    :param concurrency: the number of workers running the scenario
+    :param rate: the maximum number of calls per second, for all the workers
+    :return: a LoadTestReport
+    """
+    if iterations is None and duration is None:
+        raise ValueError("Either a number of iterations or a duration is required")
+
+    report = LoadTestReport()
+    run = ScenarioRunner(report, RateLimiter(rate) if rate else None)
+    lock = Lock()
+    counter = iter(range(iterations)) if iterations is not None else count()
+    start = monotonic()
+
+    def work():
+        while duration is None or monotonic() - start < duration:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+
+            try:
+                scenario(run, index)
+            except Exception:
+                failed = True
+            else:
+                failed = False
+
+            with lock:
+                report.scenarios += 1
+                report.failed_scenarios += failed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(work) for _ in range(concurrency)]:
+            future.result()
+
+    report.elapsed = monotonic() - start
+    return report
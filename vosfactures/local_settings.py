@@ -0,0 +1,8 @@
+HOST = "your_subdomain.vosfactures.fr"
+API_TOKEN = "your_token"
+AVAILABLE_COMMANDS = {
+    'Client': ['create', 'get', 'list', 'update', 'delete'],
+    'Product': ['create', 'get', 'list', 'update', 'delete'],
+    'Department': ['create', 'get', 'list', 'update', 'delete'],
+    'Invoice': ['create', 'get', 'list', 'update', 'delete'],
+}
@@ -4,5 +4,5 @@ AVAILABLE_COMMANDS = {
     'Client': ['create', 'get', 'list', 'update', 'delete'],
     'Product': ['create', 'get', 'list', 'update', 'delete'],
     'Department': ['create', 'get', 'list', 'update', 'delete'],
-    'Invoice': ['create', 'get', 'list', 'update', 'delete'],
+    'Invoice': ['create', 'get', 'list', 'update', 'delete', 'change_status'],
 }
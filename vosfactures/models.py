@@ -1,5 +1,10 @@
-from vosfactures.utils import delete, get, post, put
-from vosfactures.settings import AVAILABLE_COMMANDS
+import hashlib
+import os
+from collections import deque, namedtuple
+
+from vosfactures import settings
+from vosfactures.cache import default_cache
+from vosfactures.utils import CHUNK_SIZE, DownloadError, HttpError, delete, download, get, post, put, query
 
 
 class ObjectIsDeletedError(Exception):
@@ -10,7 +15,37 @@ class CommandUnavailable(Exception):
     pass
 
 
-class BaseData:
+# The result of the change of status of an invoice by Invoice.bulk_set_status(), error being None if it succeeded
+StatusChange = namedtuple('StatusChange', 'id invoice error')
+
+
+class ModelMeta(type):
+    """
+    Computes the schema of each model once, when its class is created, so that the hydration of the instances and the
+    checks made on each assignment or command don't need any reflection.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        cls = super().__new__(mcs, name, bases, namespace)
+
+        field_names = []
+        for klass in reversed(cls.__mro__):
+            for key, value in vars(klass).items():
+                if key.startswith('_') or key in field_names:
+                    continue
+                if callable(value) or isinstance(value, (property, classmethod, staticmethod)):
+                    continue
+                field_names.append(key)
+
+        cls._field_names = tuple(field_names)
+        cls._fields = frozenset(field_names)
+        cls._auto_fields = frozenset(cls._auto_data)
+        cls._default_fields = frozenset(cls._default_data)
+        cls._forbidden = frozenset(cls._forbidden_commands)
+        return cls
+
+
+class BaseData(metaclass=ModelMeta):
     _create_data = dict(json_page="", action="")
     _delete_data = dict(json_page="", action="")
     _get_data = dict(json_page="", action="")
@@ -19,49 +54,53 @@ class BaseData:
     _required_properties = []
     _auto_data = []
     _default_data = []
-    _assigning_data = False
     _is_deleted = False
     _forbidden_commands = []
     _updated_fields = []
+    _relations = {}
+    _cache = default_cache
+    _per_page = 100
+    # When set (see vosfactures.outbox.Outbox.install()), the writes are queued instead of being sent directly
+    _outbox = None
+    _last_write = None
 
-    def _check_command_available(self, command):
-        if hasattr(self, "__name__"):
-            # Called from a classmethod
-            the_class = self
-        else:
-            # Called from an instance's method
-            the_class = self.__class__
-
-        classname = the_class.__name__
-
-        if command in the_class._forbidden_commands:
-            raise CommandUnavailable('The "{}" command does not exist for {} model'.format(command, classname))
+    @classmethod
+    def _check_command_available(cls, command):
+        if command in cls._forbidden:
+            raise CommandUnavailable('The "{}" command does not exist for {} model'.format(command, cls.__name__))
 
-        if command not in AVAILABLE_COMMANDS[classname]:
-            raise CommandUnavailable('The "{}" command is not allowed for {} model'.format(command, classname))
+        # The settings are read on each check, as they can be changed (even in place) at any time
+        if command not in settings.AVAILABLE_COMMANDS[cls.__name__]:
+            raise CommandUnavailable('The "{}" command is not allowed for {} model'.format(command, cls.__name__))
 
     @classmethod
     def create(cls, **kwargs):
-        cls._check_command_available(cls, 'create')
-
-        nothing = object()
-        missing_fields = []
-        for argument in cls._required_properties:
-            if kwargs.get(argument, nothing) == nothing:
-                missing_fields.append(argument)
+        cls._check_command_available('create')
 
+        missing_fields = [argument for argument in cls._required_properties if argument not in kwargs]
         if missing_fields:
             raise ValueError('Some fields ({}) are required to create this object'.format(", ".join(missing_fields)))
 
-        for argument in cls._default_data:
-            if kwargs.get(argument, nothing) == nothing:
-                kwargs[argument] = getattr(cls, argument)
+        for argument in cls._default_fields.difference(kwargs):
+            kwargs[argument] = getattr(cls, argument)
 
         kwargs.update(cls._create_data)
+        if cls._outbox is not None:
+            element = cls._hydrate(kwargs)
+            element._last_write = cls._outbox.enqueue(element, "POST", kwargs)
+            return element
+
         element_data = post(**kwargs)
-        element = cls()
-        element._set_data(**element_data)
-        return element
+        return cls._hydrate(element_data)
+
+    @classmethod
+    def _hydrate(cls, data):
+        """
+        Returns a new instance holding the given data. The keys that aren't fields of the model are discarded.
+        """
+        instance = cls.__new__(cls)
+        instance.__dict__.update({key: data[key] for key in cls._fields.intersection(data)})
+        return instance
 
     def delete(self):
         self._check_command_available('delete')
@@ -71,41 +110,209 @@ class BaseData:
 
         kwargs = dict(instance_id=self.id)
         kwargs.update(self._delete_data)
-        delete(**kwargs)
+        if self._outbox is not None:
+            self._last_write = self._outbox.enqueue(self, "DELETE", kwargs)
+        else:
+            delete(**kwargs)
+        self._invalidate()
         self._is_deleted = True
 
+    def _invalidate(self):
+        # An object queued for creation in the outbox has no id yet, and can't be cached
+        if self.id is not None:
+            self._cache.invalidate(self.__class__, self.id)
+
     @classmethod
-    def get(cls, instance_id):
-        cls._check_command_available(cls, 'get')
+    def get(cls, instance_id, cached=False):
+        """
+        Returns the instance having the given id.
+        :param cached: True to take it from the cache (and its sources, like a snapshot) when it's there, and to cache
+        it otherwise
+        """
+        cls._check_command_available('get')
+
+        if cached:
+            element = cls._cache.get(cls, instance_id)
+            if element is not None:
+                return element
 
         kwargs = dict(instance_id=instance_id)
         kwargs.update(cls._get_data)
         element_data = get(**kwargs)
-        element = cls()
-        element._set_data(id=instance_id)
-        element._set_data(**element_data)
+        element = cls._hydrate(element_data)
+        if element.id is None:
+            element._set_data(id=instance_id)
+        if cached:
+            cls._cache.set(element)
         return element
 
     @classmethod
-    def list(cls):
-        cls._check_command_available(cls, 'list')
+    def list(cls, prefetch=(), **params):
+        """
+        Returns the instances of a single list query.
+        :param prefetch: the names of the relationships to load in bulk for all the returned instances
+        :param params: some filters, given to the API in the query string
+        """
+        cls._check_command_available('list')
+
+        kwargs = dict(cls._list_data)
+        if params:
+            kwargs['params'] = params
+        instances = [cls._hydrate(element) for element in get(**kwargs)]
+
+        cls._prefetch(instances, prefetch)
+        return instances
+
+    @classmethod
+    def iter_list(cls, prefetch=(), per_page=None, **params):
+        """
+        Yields the instances of every page of the list, querying the pages one after the other when needed.
+        :param prefetch: the names of the relationships to load in bulk, page by page
+        :param per_page: the number of instances requested per page
+        :param params: some filters, given to the API in the query string
+        """
+        for page in cls._iter_pages(per_page, **params):
+            cls._prefetch(page, prefetch)
+            yield from page
+
+    @classmethod
+    def iter_raw(cls, per_page=None, workers=1, **params):
+        """
+        Yields the data of every element of the list, as returned by the API, without building any instance.
+        :param per_page: the number of elements requested per page
+        :param workers: the number of pages queried concurrently, ahead of the one being read
+        :param params: some filters, given to the API in the query string
+        """
+        for page in cls._iter_raw_pages(per_page, workers, **params):
+            yield from page
 
-        elements = get(**cls._list_data)
-        instances = []
-        for element in elements:
-            instance = cls()
-            instance._set_data(**element)
-            instances.append(instance)
+    @classmethod
+    def _iter_raw_pages(cls, per_page=None, workers=1, **params):
+        cls._check_command_available('list')
+
+        per_page = per_page or cls._per_page
+
+        def get_page(page_number):
+            return get(params=dict(params, page=page_number, per_page=per_page), **cls._list_data)
+
+        if workers <= 1:
+            page_number = 1
+            while True:
+                page = get_page(page_number)
+                if page:
+                    yield page
+
+                if len(page) < per_page:
+                    return
+                page_number += 1
+
+        # The next pages are queried while the current one is read. As the number of pages isn't known, a few empty
+        # pages can be queried after the last one.
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque(executor.submit(get_page, page_number) for page_number in range(1, workers + 1))
+        next_page_number = workers + 1
+        try:
+            while pending:
+                page = pending.popleft().result()
+                if page:
+                    yield page
+
+                if len(page) < per_page:
+                    return
+                pending.append(executor.submit(get_page, next_page_number))
+                next_page_number += 1
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    @classmethod
+    def _iter_pages(cls, per_page=None, **params):
+        for page in cls._iter_raw_pages(per_page, **params):
+            yield [cls._hydrate(element) for element in page]
+
+    @classmethod
+    def get_many(cls, instance_ids):
+        """
+        Returns a dict of the instances having the given ids, taken from the cache when possible. The missing ones are
+        searched in the list pages (as long as it needs less queries than getting them one by one), then individually.
+        The instances that can't be got (like the deleted ones) are left out.
+        :param instance_ids: some ids, that can be repeated or None
+        """
+        instances = {}
+        missing = set()
+        for instance_id in instance_ids:
+            if instance_id is None or instance_id in instances:
+                continue
+
+            instance = cls._cache.get(cls, instance_id)
+            if instance is None:
+                missing.add(instance_id)
+            else:
+                instances[instance_id] = instance
+
+        if len(missing) > 1 and cls._is_command_available('list'):
+            for pages_count, page in enumerate(cls._iter_pages(), start=1):
+                for instance in page:
+                    cls._cache.set(instance)
+                    if instance.id in missing:
+                        missing.discard(instance.id)
+                        instances[instance.id] = instance
+
+                if len(missing) <= pages_count:
+                    # Getting the remaining instances one by one is now cheaper
+                    break
+
+        for instance_id in missing:
+            try:
+                instance = cls.get(instance_id)
+            except HttpError:
+                continue
+            cls._cache.set(instance)
+            instances[instance_id] = instance
 
         return instances
 
+    @classmethod
+    def _prefetch(cls, instances, relations):
+        """
+        Loads into the cache the related objects of all the given instances at once.
+        :param instances: some instances of this model
+        :param relations: some names of relationships, as defined in _relations
+        """
+        if isinstance(relations, str):
+            relations = [relations]
+
+        for relation in relations:
+            if relation not in cls._relations:
+                raise ValueError('The "{}" relationship does not exist for {} model'.format(relation, cls.__name__))
+
+            model, get_ids = cls._relations[relation]
+            model.get_many([instance_id for instance in instances for instance_id in get_ids(instance)])
+
+    def _get_related(self, relation):
+        model, get_ids = self._relations[relation]
+        ids = get_ids(self)
+        instances = model.get_many(ids)
+        return [instances[instance_id] for instance_id in ids if instance_id in instances]
+
+    @classmethod
+    def _is_command_available(cls, command):
+        try:
+            cls._check_command_available(command)
+        except CommandUnavailable:
+            return False
+        return True
+
     def update(self):
         self._check_command_available('update')
 
         if self._is_deleted:
             raise ObjectIsDeletedError("This object doesn't exist anymore")
 
-        kwargs = self._update_data
+        kwargs = dict(self._update_data)
 
         updated_fields = self._updated_fields
         for prop in updated_fields:
@@ -113,11 +320,20 @@ class BaseData:
             if val is None:
                 continue
 
-            if prop not in self._auto_data:
+            if prop not in self._auto_fields:
                 kwargs[prop] = getattr(self, prop)
 
-        self._updated_fields = []
+        if self._outbox is not None:
+            # The instance will get the data returned by the API once the update has been sent
+            self._last_write = self._outbox.enqueue(self, "PUT", dict(kwargs, instance_id=self.id))
+            self._updated_fields = []
+            self._invalidate()
+            return self
+
+        # The fields stay updated if the query fails, so that the update can be retried
         element_data = put(instance_id=self.id, **kwargs)
+        self._updated_fields = []
+        self._invalidate()
         self._set_data(**element_data)
         return self
 
@@ -127,32 +343,41 @@ class BaseData:
         discarded.
         :param data: some keyword arguments
         """
-        tmp = self._assigning_data
-        self._assigning_data = True
-        for key, value in data.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
+        if self._is_deleted:
+            raise ObjectIsDeletedError("This object doesn't exist anymore")
 
-        self._assigning_data = tmp
+        self.__dict__.update({key: data[key] for key in self._fields.intersection(data)})
 
     def __setattr__(self, key, value):
         if self._is_deleted:
             raise ObjectIsDeletedError("This object doesn't exist anymore")
 
-        if not self._assigning_data:
-            if key in self._auto_data:
-                raise Exception("The following properties are set automatically and can't be edited : {}".format(
-                    self._auto_data))
+        if key in self._auto_fields:
+            raise Exception("The following properties are set automatically and can't be edited : {}".format(
+                self._auto_data))
 
-            if not key.startswith('_'):
-                # We don't send hidden properties
-                self._updated_fields.append(key)
+        if not key.startswith('_'):
+            # We don't send hidden properties. Each instance gets its own list, to avoid altering the one of the class.
+            updated_fields = self.__dict__.get('_updated_fields')
+            if updated_fields is None:
+                self.__dict__['_updated_fields'] = [key]
+            elif key not in updated_fields:
+                updated_fields.append(key)
 
-        super().__setattr__(key, value)
+        object.__setattr__(self, key, value)
 
     def is_deleted(self):
         return self._is_deleted
 
+    def is_dirty(self):
+        return bool(self._updated_fields)
+
+    def last_write(self):
+        """
+        Returns the OutboxHandle of the last write of this instance queued in the outbox, or None.
+        """
+        return self._last_write
+
 
 # Values for the fields
 
@@ -304,9 +529,15 @@ class Invoice(BaseData):
     _get_data = dict(json_page="invoices", action="invoice")
     _list_data = dict(json_page="invoices", action="invoices")
     _update_data = dict(json_page="invoices", action="invoice")
+    _change_status_data = dict(json_page="invoices/{}/change_status", action="invoice")
     _required_properties = ["title", "issue_date", "department_id", "client_id", "positions"]
     _auto_data = ['created_at', 'updated_at']
     _default_data = ['kind']
+    _relations = {
+        'client': (Client, lambda invoice: [invoice.client_id]),
+        'department': (Department, lambda invoice: [invoice.department_id]),
+        'products': (Product, lambda invoice: [position.get('product_id') for position in invoice.positions]),
+    }
 
     id = None
     title = ""  # Objet
@@ -322,6 +553,7 @@ class Invoice(BaseData):
     lang = "fr"  # langue du document
     recipient_id = None
     client_id = None
+    department_id = None
     invoice_id = None
     kind = DocumentKind.bill
     token = None
@@ -346,6 +578,21 @@ class Invoice(BaseData):
     def __str__(self):
         return "{} : {} ({} {})".format(self.id, self.number, self.price_net, self.currency)
 
+    @property
+    def client(self):
+        clients = self._get_related('client')
+        return clients[0] if clients else None
+
+    @property
+    def department(self):
+        departments = self._get_related('department')
+        return departments[0] if departments else None
+
+    @property
+    def products(self):
+        # The products of the positions, in the same order
+        return self._get_related('products')
+
     @classmethod
     def create(cls, **kwargs):
         # For my needs, I want to prevent the  creation of products from the creation of invoices. Products should be
@@ -367,6 +614,145 @@ class Invoice(BaseData):
 
         return super().create(**kwargs)
 
-    def set_status(self, status):
-        self.status = status
-        self.update()
+    def set_status(self, status, paid_date=None, refresh=False):
+        """
+        Changes the status of the invoice, without sending the other fields nor reading the invoice returned by the
+        API. The change-status endpoint is used when it's available, and an update of these fields only otherwise.
+        :param status: a value of Status
+        :param paid_date: the payment date, sent with the status (through an update) if given
+        :param refresh: True to reload the whole invoice afterwards
+        """
+        if self._is_deleted:
+            raise ObjectIsDeletedError("This object doesn't exist anymore")
+
+        fields = dict(status=status)
+        if paid_date is not None:
+            fields['paid_date'] = paid_date
+
+        if paid_date is None and self.id is not None and self._is_command_available('change_status'):
+            method = "POST"
+            kwargs = dict(json_page=self._change_status_data['json_page'].format(self.id),
+                          action=self._change_status_data['action'], params=dict(status=status))
+        else:
+            self._check_command_available('update')
+            method = "PUT"
+            kwargs = dict(self._update_data, instance_id=self.id, **fields)
+
+        if self._outbox is not None:
+            self._last_write = self._outbox.enqueue(self, method, kwargs)
+        else:
+            query(method=method, **kwargs)
+
+        # The fields are only changed once sent (or queued), and then they aren't marked as updated anymore
+        self.__dict__.update(fields)
+        updated_fields = [field for field in self._updated_fields if field not in fields]
+        if len(updated_fields) != len(self._updated_fields):
+            self._updated_fields = updated_fields
+
+        if refresh and self._outbox is None:
+            self._set_data(**get(instance_id=self.id, **self._get_data))
+        self._invalidate()
+        return self
+
+    @classmethod
+    def bulk_set_status(cls, invoices, status, paid_date=None, workers=8, refresh=False):
+        """
+        Changes the status of many invoices concurrently (see set_status()), without loading them first. A failure
+        doesn't stop the other changes.
+        :param invoices: some ids of invoices, or some Invoice instances
+        :param workers: the number of concurrent queries
+        :return: a list of StatusChange (id, invoice, error), in the same order as the invoices
+        """
+        def set_status(invoice):
+            if not isinstance(invoice, cls):
+                invoice = cls._hydrate(dict(id=invoice))
+            try:
+                invoice.set_status(status, paid_date=paid_date, refresh=refresh)
+            except Exception as e:
+                return StatusChange(invoice.id, invoice, e)
+            return StatusChange(invoice.id, invoice, None)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(set_status, invoices))
+
+    def compute_totals(self, products=None, calculating_strategy=None):
+        """
+        Returns the totals of the invoice computed locally from its positions, without querying the API (except for
+        the products that aren't in the cache). See vosfactures.totals.compute_totals().
+        """
+        from vosfactures.totals import compute_totals
+
+        if calculating_strategy is None:
+            calculating_strategy = self.calculating_strategy
+        return compute_totals(self.positions, products, calculating_strategy)
+
+    @classmethod
+    def export_pdfs(cls, filters, dest_zip, workers=4, progress=None, **kwargs):
+        """
+        Exports the PDFs of the invoices matching the filters into a ZIP archive, resuming the export if the archive
+        already exists. See vosfactures.archive.export_pdfs() for the other arguments.
+        :param filters: the filters of the list query used to select the invoices, like {"period": "last_year"}
+        :return: the ExportStats of the export
+        """
+        from vosfactures.archive import export_pdfs
+
+        return export_pdfs(cls.iter_list(**filters), dest_zip, workers=workers, progress=progress, **kwargs)
+
+    def iter_pdf_chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields the content of the PDF of the invoice in chunks of chunk_size bytes.
+        """
+        self._check_command_available('get')
+
+        if self._is_deleted:
+            raise ObjectIsDeletedError("This object doesn't exist anymore")
+
+        if self.id is None:
+            raise ValueError("The invoice has to be created before its PDF can be downloaded")
+
+        return download(json_page=self._get_data['json_page'], instance_id=self.id, extension="pdf",
+                        chunk_size=chunk_size)
+
+    def download_pdf(self, path_or_fileobj, chunk_size=CHUNK_SIZE, expected_size=None, checksum=None,
+                     checksum_algorithm="sha256"):
+        """
+        Writes the PDF of the invoice to a file, chunk by chunk, so that the memory used doesn't depend on its size.
+        When a path is given, the file is only created once the download is complete and verified.
+        :param path_or_fileobj: the path of the file to create, or a file object opened in binary mode
+        :param expected_size: the size in bytes the PDF should have, if known
+        :param checksum: the hexadecimal digest the PDF should have, if known
+        :param checksum_algorithm: the name of the hashlib algorithm used to compute the checksum
+        :return: the number of bytes written
+        :raise DownloadError: if the size or the checksum of the downloaded PDF isn't the expected one
+        """
+        if not hasattr(path_or_fileobj, 'write'):
+            tmp_path = "{}.part".format(path_or_fileobj)
+            try:
+                with open(tmp_path, 'wb') as fileobj:
+                    size = self.download_pdf(fileobj, chunk_size, expected_size, checksum, checksum_algorithm)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            os.replace(tmp_path, path_or_fileobj)
+            return size
+
+        digest = hashlib.new(checksum_algorithm) if checksum is not None else None
+        size = 0
+        for chunk in self.iter_pdf_chunks(chunk_size):
+            path_or_fileobj.write(chunk)
+            size += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+
+        if expected_size is not None and size != expected_size:
+            raise DownloadError("The PDF of invoice {} has {} bytes instead of {}".format(self.id, size, expected_size))
+
+        if digest is not None and digest.hexdigest() != checksum.lower():
+            raise DownloadError("The {} checksum of the PDF of invoice {} is {} instead of {}".format(
+                checksum_algorithm, self.id, digest.hexdigest(), checksum))
+
+        return size
@@ -0,0 +1,365 @@
+import json
+import sqlite3
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, Thread
+from time import monotonic, time
+from uuid import uuid4
+
+from vosfactures import utils
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+# The minimum delay in seconds between two purges of the finished writes
+PURGE_INTERVAL = 60.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    object_key TEXT NOT NULL,
+    method TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS operations_status ON operations (status, id);
+CREATE INDEX IF NOT EXISTS operations_object_key ON operations (object_key, id);
+CREATE INDEX IF NOT EXISTS operations_status_object_key ON operations (status, object_key, id);
+"""
+
+
+class OutboxError(Exception):
+    pass
+
+
+class OutboxHandle:
+    """
+    The completion handle of a queued write.
+    """
+
+    def __init__(self, outbox, operation_id):
+        self.outbox = outbox
+        self.operation_id = operation_id
+
+    @property
+    def status(self):
+        return self.outbox._get_operation(self.operation_id)['status']
+
+    def done(self):
+        return self.status != PENDING
+
+    def wait(self, timeout=None):
+        """
+        Waits until the write has been sent to the API.
+        :return: the data returned by the API
+        :raise OutboxError: if the write failed after all its attempts
+        :raise TimeoutError: if it's still pending after timeout seconds
+        """
+        if not self.outbox._get_event(self.operation_id).wait(timeout):
+            raise TimeoutError("The operation {} is still pending".format(self.operation_id))
+        self.outbox._forget_event(self.operation_id)
+
+        operation = self.outbox._get_operation(self.operation_id)
+        if operation['status'] == FAILED:
+            raise OutboxError("The operation {} failed : {}".format(self.operation_id, operation['error']))
+        return operation['result']
+
+
+class Outbox:
+    """
+    A durable queue of the writes (create, update, delete) made on the models, stored in a SQLite database. Once
+    installed, the writes are queued and return immediately, and a pool of workers sends them to the API in the
+    background, in order for each object, with retries.
+
+    The writes are sent at least once : a write interrupted by the end of the process is sent again when an outbox is
+    started on the same database. The finished writes are kept for some time (so that their handles can still be
+    waited), then purged.
+    """
+
+    def __init__(self, path, workers=4, batch_size=100, max_attempts=5, retry_backoff=1., poll_interval=1.,
+                 retention=3600.):
+        """
+        :param path: the path of the SQLite database
+        :param workers: the number of writes sent concurrently (to different objects)
+        :param batch_size: the maximum number of objects whose pending writes are read from the database at a time,
+        and of updates of an object merged into a single one
+        :param max_attempts: the number of attempts after which a write is marked as failed
+        :param retry_backoff: the delay in seconds before the first retry, doubled for each following one
+        :param poll_interval: the maximum delay in seconds before checking the database for retries
+        :param retention: the delay in seconds after which the finished writes are purged, or None to keep them
+        """
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.retention = retention
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+        self._condition = Condition()
+        self._in_flight = set()
+        self._events = {}
+        self._instances = weakref.WeakValueDictionary()
+        self._executor = None
+        self._dispatcher = None
+        self._stopping = False
+        self._purged_at = None
+
+    def __enter__(self):
+        self.install()
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+        self.stop()
+
+    def install(self):
+        """
+        Makes the writes of all the models go through this outbox.
+        """
+        from vosfactures.models import BaseData
+
+        BaseData._outbox = self
+
+    def uninstall(self):
+        from vosfactures.models import BaseData
+
+        if BaseData._outbox is self:
+            BaseData._outbox = None
+
+    def start(self):
+        if self._dispatcher is not None:
+            return
+
+        self._stopping = False
+        self._purged_at = None
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._dispatcher = Thread(target=self._dispatch, name="vosfactures-outbox", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        """
+        Stops the workers once the writes being sent are done. The pending ones stay in the database.
+        """
+        if self._dispatcher is None:
+            return
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown()
+        self._dispatcher = None
+        self._executor = None
+
+    def close(self):
+        self.stop()
+        self._connection.close()
+
+    def drain(self, timeout=None):
+        """
+        Waits until there is no pending write left.
+        :return: True if the outbox is empty, False if the timeout expired before
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while self.pending_count():
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining if remaining is not None else self.poll_interval)
+        return True
+
+    def purge(self, older_than=0.):
+        """
+        Deletes the writes that were done or failed more than older_than seconds ago. The ones of the objects still
+        having some pending writes are kept, as these writes may need the id returned by their creation.
+        :return: the number of deleted writes
+        """
+        with self._condition:
+            cursor = self._connection.execute(
+                "DELETE FROM operations WHERE status != ? AND finished_at <= ? AND object_key NOT IN ("
+                "SELECT object_key FROM operations WHERE status = ?)", (PENDING, time() - older_than, PENDING))
+            return cursor.rowcount
+
+    def pending_count(self):
+        rows, _ = self._execute("SELECT COUNT(*) FROM operations WHERE status = ?", PENDING)
+        return rows[0][0]
+
+    def enqueue(self, instance, method, payload):
+        """
+        Queues a write of the given instance.
+        :param method: "POST", "PUT" or "DELETE"
+        :param payload: the keyword arguments of utils.query()
+        :return: an OutboxHandle
+        """
+        object_key = instance.__dict__.get('_outbox_key')
+        if object_key is None:
+            if instance.id is None:
+                object_key = "{}:new:{}".format(instance.__class__.__name__, uuid4().hex)
+            else:
+                object_key = "{}:{}".format(instance.__class__.__name__, instance.id)
+            instance._outbox_key = object_key
+
+        _, operation_id = self._execute(
+            "INSERT INTO operations (object_key, method, payload, created_at) VALUES (?, ?, ?, ?)",
+            object_key, method, json.dumps(payload), time())
+        if method != "DELETE":
+            # The instance gets the data returned by the API, if it's still used
+            self._instances[operation_id] = instance
+
+        with self._condition:
+            self._condition.notify_all()
+        return OutboxHandle(self, operation_id)
+
+    def _execute(self, sql, *parameters):
+        # The connection is shared by the threads, so the rows are fetched while holding the lock
+        with self._condition:
+            cursor = self._connection.execute(sql, parameters)
+            return cursor.fetchall(), cursor.lastrowid
+
+    def _get_operation(self, operation_id):
+        rows, _ = self._execute("SELECT status, result, error FROM operations WHERE id = ?", operation_id)
+        if not rows:
+            raise OutboxError("The operation {} doesn't exist".format(operation_id))
+
+        status, result, error = rows[0]
+        return dict(status=status, result=json.loads(result) if result else None, error=error)
+
+    def _get_event(self, operation_id):
+        with self._condition:
+            event = self._events.get(operation_id)
+            if event is None:
+                event = self._events[operation_id] = Event()
+                if self._get_operation(operation_id)['status'] != PENDING:
+                    event.set()
+            return event
+
+    def _forget_event(self, operation_id):
+        with self._condition:
+            self._events.pop(operation_id, None)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+
+                if self.retention is not None and (
+                        self._purged_at is None or monotonic() - self._purged_at >= PURGE_INTERVAL):
+                    self.purge(self.retention)
+                    self._purged_at = monotonic()
+
+                batches = self._get_batches()
+                for operations in batches:
+                    self._in_flight.add(operations[0]['object_key'])
+                    self._executor.submit(self._send, operations)
+
+                if not batches:
+                    self._condition.wait(self.poll_interval)
+
+    def _get_batches(self):
+        """
+        Returns the lists of operations that can be sent now : for each object without a write in flight, its first
+        pending operation, with the updates that directly follow it merged into a single one.
+        """
+        # The first pending operation of each object, so that the objects waiting for a retry (or having a write in
+        # flight) don't hold back the others, however many operations they have
+        heads = self._connection.execute(
+            "SELECT operations.object_key, operations.next_attempt_at FROM operations JOIN ("
+            "SELECT MIN(id) AS id FROM operations WHERE status = ? GROUP BY object_key) AS heads "
+            "ON operations.id = heads.id ORDER BY operations.id", (PENDING,)).fetchall()
+
+        now = time()
+        object_keys = [object_key for object_key, next_attempt_at in heads
+                       if object_key not in self._in_flight and next_attempt_at <= now][:self.batch_size]
+
+        batches = []
+        for object_key in object_keys:
+            rows = self._connection.execute(
+                "SELECT id, method, payload FROM operations WHERE object_key = ? AND status = ? ORDER BY id LIMIT ?",
+                (object_key, PENDING, self.batch_size)).fetchall()
+
+            batch = []
+            for operation_id, method, payload in rows:
+                if batch and not (method == "PUT" and batch[-1]['method'] == "PUT"):
+                    break
+                batch.append(dict(id=operation_id, object_key=object_key, method=method, payload=json.loads(payload)))
+            batches.append(batch)
+
+        return batches
+
+    def _send(self, operations):
+        first, object_key = operations[0], operations[0]['object_key']
+        payload = dict(first['payload'])
+        for operation in operations[1:]:
+            payload.update(operation['payload'])
+
+        try:
+            if payload.get('instance_id', 0) is None:
+                # The object has been created through the outbox : it has the id returned by its creation
+                payload['instance_id'] = self._get_created_id(object_key)
+            result = utils.query(method=first['method'], **payload)
+        except Exception as e:
+            self._fail(operations, e)
+        else:
+            self._succeed(operations, result)
+        finally:
+            with self._condition:
+                self._in_flight.discard(object_key)
+                self._condition.notify_all()
+
+    def _get_created_id(self, object_key):
+        rows, _ = self._execute("SELECT status, result FROM operations WHERE object_key = ? AND method = 'POST' "
+                                "ORDER BY id LIMIT 1", object_key)
+        if not rows or rows[0][0] != DONE:
+            raise OutboxError("The creation of this object failed")
+        return json.loads(rows[0][1])['id']
+
+    def _succeed(self, operations, result):
+        with self._condition:
+            for operation in operations:
+                self._connection.execute(
+                    "UPDATE operations SET status = ?, result = ?, error = NULL, finished_at = ? WHERE id = ?",
+                    (DONE, json.dumps(result), time(), operation['id']))
+
+        instance = self._instances.get(operations[-1]['id'])
+        if instance is not None and isinstance(result, dict) and not instance.is_deleted():
+            instance._set_data(**result)
+
+        self._set_events(operations)
+
+    def _fail(self, operations, error):
+        with self._condition:
+            for operation in operations:
+                attempts = self._connection.execute(
+                    "SELECT attempts FROM operations WHERE id = ?", (operation['id'],)).fetchone()[0] + 1
+                if attempts >= self.max_attempts or isinstance(error, OutboxError):
+                    self._connection.execute(
+                        "UPDATE operations SET status = ?, attempts = ?, error = ?, finished_at = ? WHERE id = ?",
+                        (FAILED, attempts, repr(error), time(), operation['id']))
+                else:
+                    self._connection.execute(
+                        "UPDATE operations SET attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?",
+                        (attempts, time() + self.retry_backoff * 2 ** (attempts - 1), repr(error), operation['id']))
+
+        self._set_events(operations)
+
+    def _set_events(self, operations):
+        with self._condition:
+            for operation in operations:
+                event = self._events.get(operation['id'])
+                if event is not None and self._get_operation(operation['id'])['status'] != PENDING:
+                    event.set()
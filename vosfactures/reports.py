@@ -0,0 +1,197 @@
+"""
+Aggregation of invoices by group (client, month, kind, status, income...), consuming the invoices one after the other
+so that the memory used depends on the number of groups rather than on the number of invoices.
+"""
+from itertools import islice
+
+from vosfactures.models import Invoice
+from vosfactures.totals import from_cents, to_scaled
+
+# The functions giving the value of a group for the data of an invoice, by name
+GROUP_KEYS = {
+    'client': lambda invoice: invoice.get('client_id'),
+    'department': lambda invoice: invoice.get('department_id'),
+    'year': lambda invoice: (invoice.get('issue_date') or '')[:4],
+    'month': lambda invoice: (invoice.get('issue_date') or '')[:7],
+    'kind': lambda invoice: invoice.get('kind'),
+    'status': lambda invoice: invoice.get('status'),
+    'income': lambda invoice: invoice.get('income'),
+    'currency': lambda invoice: invoice.get('currency'),
+}
+
+# The data fields read by the groups whose name isn't a field
+GROUP_FIELDS = {
+    'client': 'client_id',
+    'department': 'department_id',
+    'year': 'issue_date',
+    'month': 'issue_date',
+}
+
+# The fields of the invoices read by the aggregation, besides the ones of the groups
+AMOUNT_FIELDS = ('price_net', 'price_gross', 'paid')
+
+
+class GroupTotals:
+    """
+    The totals of a group of invoices. The amounts are Decimals.
+    """
+
+    def __init__(self, count=0, price_net=0, price_gross=0, paid=0):
+        self.count = int(count)
+        self.price_net = from_cents(price_net)
+        self.price_gross = from_cents(price_gross)
+        self.paid = from_cents(paid)
+
+    @property
+    def outstanding(self):
+        return self.price_gross - self.paid
+
+    def __eq__(self, other):
+        return isinstance(other, GroupTotals) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return "GroupTotals(count={}, price_net={}, price_gross={}, paid={}, outstanding={})".format(
+            self.count, self.price_net, self.price_gross, self.paid, self.outstanding)
+
+
+def get_group_key_functions(group_by):
+    functions = []
+    for group in group_by:
+        if callable(group):
+            functions.append(group)
+        elif group in GROUP_KEYS:
+            functions.append(GROUP_KEYS[group])
+        else:
+            # Any other field of the invoices
+            functions.append(lambda invoice, field=group: invoice.get(field))
+    return functions
+
+
+def make_key_function(key_functions):
+    if len(key_functions) == 1:
+        function, = key_functions
+        return lambda invoice: (function(invoice),)
+    return lambda invoice: tuple([function(invoice) for function in key_functions])
+
+
+def to_cents(amount):
+    # The amounts can be missing, or written with a comma (like Invoice.paid)
+    if amount is None or amount == '':
+        return 0
+    return to_scaled(amount, 100)
+
+
+def get_data_fields(group_by):
+    """
+    Returns the fields to read from the invoices given as instances. Only the data fields are read, as some names of
+    groups (like "client") are also some properties of the invoices that would query the API.
+    """
+    if any(callable(group) for group in group_by):
+        # The callables can read any field
+        return Invoice._field_names
+
+    fields = set(AMOUNT_FIELDS)
+    fields.update(GROUP_FIELDS.get(group, group) for group in group_by)
+    return tuple(field for field in Invoice._field_names if field in fields)
+
+
+def as_dict(invoice, fields):
+    # The invoices can be given as data (like Invoice.iter_raw()) or as instances (like a local mirror would keep)
+    if isinstance(invoice, dict):
+        return invoice
+    return {field: getattr(invoice, field, None) for field in fields}
+
+
+def aggregate(invoices, group_by=('client',), use_numpy=False, chunk_size=10000):
+    """
+    Returns the totals of the invoices by group.
+    :param invoices: an iterable of invoices, as dicts or instances, consumed lazily (like Invoice.iter_raw())
+    :param group_by: the names of the groups (see GROUP_KEYS), of any other field of the invoices, or some callables
+    receiving the data of an invoice as a dict
+    :param use_numpy: True to parse and sum the amounts with NumPy, by chunks. It's only faster when the amounts are
+    rarely repeated, as the plain path parses each distinct amount once.
+    :param chunk_size: the number of invoices read at a time when using NumPy
+    :return: a dict of GroupTotals, by tuple of group values
+    """
+    get_key = make_key_function(get_group_key_functions(group_by))
+    fields = get_data_fields(group_by)
+
+    invoices = (as_dict(invoice, fields) for invoice in invoices)
+    if not use_numpy:
+        return _aggregate(invoices, get_key)
+
+    import numpy
+
+    return _aggregate_numpy(numpy, invoices, get_key, chunk_size)
+
+
+def _aggregate(invoices, get_key):
+    groups = {}
+    # The amounts are often the same, so they are parsed once (in a bounded cache, to keep the memory used constant)
+    parsed = {}
+    for invoice in invoices:
+        key = get_key(invoice)
+        totals = groups.get(key)
+        if totals is None:
+            totals = groups[key] = [0, 0, 0, 0]
+        totals[0] += 1
+
+        for index, field in enumerate(AMOUNT_FIELDS, start=1):
+            amount = invoice.get(field)
+            cents = parsed.get(amount)
+            if cents is None:
+                if len(parsed) > 100000:
+                    parsed.clear()
+                cents = parsed[amount] = to_cents(amount)
+            totals[index] += cents
+
+    return {key: GroupTotals(*totals) for key, totals in groups.items()}
+
+
+def _parse_amounts(numpy, amounts):
+    """
+    Returns the amounts in cents, as an array of integers. They are parsed by NumPy as floats when it's exact
+    (amounts with up to 2 decimals, far from the precision limit of the floats), and one by one otherwise.
+    """
+    try:
+        values = numpy.array([0 if amount is None or amount == '' else amount for amount in amounts], dtype=float)
+    except ValueError:
+        # Some amounts are written with a comma
+        values = None
+
+    if values is not None:
+        cents = numpy.rint(values * 100)
+        if not len(cents) or (numpy.abs(cents).max() < 1e12 and numpy.abs(values * 100 - cents).max() < 1e-4):
+            return cents.astype(numpy.int64)
+
+    return numpy.fromiter((to_cents(amount) for amount in amounts), dtype=numpy.int64, count=len(amounts))
+
+
+def _aggregate_numpy(numpy, invoices, get_key, chunk_size):
+    # The amounts of each chunk are summed by group, in accumulators growing with the number of groups
+    groups = {}
+    sums = numpy.zeros((4, 0), dtype=numpy.int64)
+    while True:
+        chunk = list(islice(invoices, chunk_size))
+        if not chunk:
+            break
+
+        codes = numpy.fromiter((groups.setdefault(get_key(invoice), len(groups)) for invoice in chunk),
+                               dtype=numpy.int64, count=len(chunk))
+        if sums.shape[1] < len(groups):
+            sums = numpy.pad(sums, ((0, 0), (0, len(groups) - sums.shape[1])))
+
+        sums[0] += numpy.bincount(codes, minlength=len(groups))
+        for row, field in enumerate(AMOUNT_FIELDS, start=1):
+            amounts = _parse_amounts(numpy, [invoice.get(field) for invoice in chunk])
+            numpy.add.at(sums[row], codes, amounts)
+
+    return {key: GroupTotals(*sums[:, code]) for key, code in groups.items()}
+
+
+def aggregate_invoices(group_by=('client',), use_numpy=False, **filters):
+    """
+    Returns the totals by group of the invoices of the API matching the filters (like period="this_year"), reading
+    them page by page.
+    """
+    return aggregate(Invoice.iter_raw(**filters), group_by=group_by, use_numpy=use_numpy)
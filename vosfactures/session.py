@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
+
+from vosfactures.models import BaseData
+
+
+class FlushError(Exception):
+    def __init__(self, errors):
+        # errors is a list of (instance, command, exception) tuples
+        self.errors = errors
+        super().__init__("{} operation(s) failed during the flush : {}".format(
+            len(errors), ", ".join("{} {} ({})".format(command, instance.__class__.__name__, error)
+                                   for instance, command, error in errors)))
+
+
+def get_rank(model):
+    """
+    Returns the position of a model in the creation order : a model is created after the ones it references.
+    """
+    if not model._relations:
+        return 0
+    return 1 + max(get_rank(related_model) for related_model, _ in model._relations.values())
+
+
+def resolve_references(value):
+    """
+    Replaces the instances found in a value (even inside lists and dicts) by their ids, so that a new product can be
+    used in the positions of a new invoice before being created : positions=[{"product_id": product}].
+    """
+    if isinstance(value, BaseData):
+        if value.id is None:
+            raise ValueError("{} is referenced before being created".format(value.__class__.__name__))
+        return value.id
+
+    if isinstance(value, dict):
+        return {key: resolve_references(val) for key, val in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [resolve_references(val) for val in value]
+
+    return value
+
+
+class Session:
+    """
+    Keeps a single instance per model and id, and the list of the changes to send to the API (new, modified and
+    deleted objects). The changes are sent concurrently by flush(), a model being created after the models it
+    references and deleted before them.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._lock = RLock()
+        self._identity_map = {}
+        self._new = []
+        self._deleted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def get(self, model, instance_id):
+        with self._lock:
+            instance = self._identity_map.get((model, instance_id))
+
+        if instance is None:
+            instance = self.merge(model.get(instance_id))
+        return instance
+
+    def list(self, model, **params):
+        return [self.merge(instance) for instance in model.list(**params)]
+
+    def merge(self, instance):
+        """
+        Returns the instance of the session having the same id as the given one. If it already exists, it is refreshed
+        with the data of the given instance, except for the fields that have been modified and not flushed yet.
+        """
+        key = (instance.__class__, instance.id)
+        with self._lock:
+            existing = self._identity_map.get(key)
+            if existing is None:
+                self._identity_map[key] = instance
+                return instance
+
+        if existing is not instance:
+            data = {field: value for field, value in vars(instance).items()
+                    if not field.startswith('_') and field not in existing._updated_fields}
+            existing._set_data(**data)
+        return existing
+
+    def add(self, instance):
+        """
+        Adds an instance to the session : it will be created during the next flush if it doesn't have an id yet.
+        """
+        if instance.id is not None:
+            return self.merge(instance)
+
+        with self._lock:
+            if instance not in self._new:
+                self._new.append(instance)
+        return instance
+
+    def create(self, model, **fields):
+        """
+        Returns a new instance of the model, that will be created during the next flush.
+        """
+        instance = model()
+        for field, value in fields.items():
+            setattr(instance, field, value)
+        return self.add(instance)
+
+    def delete(self, instance):
+        with self._lock:
+            if instance in self._new:
+                # It has never been sent to the API
+                self._new.remove(instance)
+            elif instance not in self._deleted:
+                self._deleted.append(instance)
+
+    @property
+    def new(self):
+        with self._lock:
+            return list(self._new)
+
+    @property
+    def dirty(self):
+        with self._lock:
+            return [instance for instance in self._identity_map.values()
+                    if instance.is_dirty() and not instance.is_deleted() and instance not in self._deleted]
+
+    @property
+    def deleted(self):
+        with self._lock:
+            return list(self._deleted)
+
+    def flush(self):
+        """
+        Sends all the pending changes to the API : creations, then updates, then deletions. The operations of a same
+        step and rank are done concurrently. If some of them fail, the following steps are skipped, the changes that
+        weren't sent stay pending, and a FlushError is raised.
+        """
+        errors = []
+        steps = [
+            (self.new, self._create, False),
+            (self.dirty, self._update, False),
+            (self.deleted, self._delete, True),
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for instances, operation, reverse in steps:
+                ranks = sorted({get_rank(instance.__class__) for instance in instances}, reverse=reverse)
+                for rank in ranks:
+                    group = [instance for instance in instances if get_rank(instance.__class__) == rank]
+                    for instance, error in zip(group, executor.map(self._run(operation), group)):
+                        if error is not None:
+                            errors.append((instance, operation.__name__.strip('_'), error))
+
+                    if errors:
+                        raise FlushError(errors)
+
+    @staticmethod
+    def _run(operation):
+        def run(instance):
+            try:
+                operation(instance)
+            except Exception as e:
+                return e
+
+        return run
+
+    def _create(self, instance):
+        fields = {field: resolve_references(getattr(instance, field)) for field in instance._updated_fields}
+        created = instance.__class__.create(**fields)
+        instance._set_data(**{field: value for field, value in vars(created).items() if not field.startswith('_')})
+        instance._updated_fields = []
+
+        with self._lock:
+            self._new.remove(instance)
+            self._identity_map[(instance.__class__, instance.id)] = instance
+
+    def _update(self, instance):
+        fields = {field: resolve_references(getattr(instance, field)) for field in instance._updated_fields}
+        instance._set_data(**fields)
+        instance.update()
+
+    def _delete(self, instance):
+        instance.delete()
+
+        with self._lock:
+            self._deleted.remove(instance)
+            self._identity_map.pop((instance.__class__, instance.id), None)
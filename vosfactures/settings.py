@@ -1,10 +1,35 @@
-try:
-    # Getting the settings from django
-    from django.conf import settings
-except (ImportError, ImportError):
-    # getting the settings from the local local_settings.py file
-    from vosfactures.local_settings import *
-else:
-    HOST = settings.VOSFACTURES_HOST
-    API_TOKEN = settings.VOSFACTURES_API_TOKEN
-    AVAILABLE_COMMANDS = settings.VOSFACTURES_AVAILABLE_COMMANDS
+# The settings are resolved on first access rather than when the module is imported : getting them from django can
+# trigger the whole configuration of the project, which the scripts that only import the package shouldn't pay for.
+SETTINGS_NAMES = ("HOST", "API_TOKEN", "AVAILABLE_COMMANDS")
+
+
+def load():
+    """
+    Gets the settings from django if it's available, or from the local_settings.py file otherwise. The values that have
+    already been set on this module are kept.
+    """
+    try:
+        # Getting the settings from django
+        from django.conf import settings
+    except ImportError:
+        # getting the settings from the local local_settings.py file
+        from vosfactures import local_settings
+        values = {name: value for name, value in vars(local_settings).items() if not name.startswith('_')}
+    else:
+        values = dict(
+            HOST=settings.VOSFACTURES_HOST,
+            API_TOKEN=settings.VOSFACTURES_API_TOKEN,
+            AVAILABLE_COMMANDS=settings.VOSFACTURES_AVAILABLE_COMMANDS,
+        )
+
+    for name, value in values.items():
+        globals().setdefault(name, value)
+
+
+def __getattr__(name):
+    # Only called for the names that aren't defined yet
+    if name in SETTINGS_NAMES:
+        load()
+        return globals()[name]
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,184 @@
+"""
+Snapshots of the catalog (products, clients and departments) in an indexed SQLite file, so that new processes start
+with a warm cache : a snapshot is dumped once (like when deploying), then loaded by each worker as a source of the cache.
+Loading only opens the file, and each row is parsed when it's first read.
+
+The rows of a loaded snapshot can be revalidated in the background, by comparing their updated_at with the one of the
+elements of the list queries of the API.
+"""
+import json
+import os
+import sqlite3
+from threading import Event, Lock, Thread
+from time import time
+
+from vosfactures.cache import default_cache
+from vosfactures.models import Client, Department, Product
+
+SNAPSHOT_MODELS = (Product, Client, Department)
+
+SCHEMA = """
+CREATE TABLE rows (
+    model TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    updated_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (model, id)
+) WITHOUT ROWID;
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def dump_snapshot(path, models=SNAPSHOT_MODELS, workers=1):
+    """
+    Writes all the elements of the given models into a snapshot file. The file is replaced at once when it's complete,
+    so that the workers never load a partial snapshot.
+    :param workers: the number of list pages queried concurrently
+    :return: the number of elements written, by model name
+    """
+    temporary_path = "{}.part".format(path)
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    counts = {}
+    connection = sqlite3.connect(temporary_path)
+    try:
+        connection.executescript(SCHEMA)
+        for model in models:
+            counts[model.__name__] = 0
+            for page in model._iter_raw_pages(workers=workers):
+                connection.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)", [
+                    (model.__name__, element['id'], element.get('updated_at'),
+                     json.dumps(element, separators=(',', ':'))) for element in page])
+                counts[model.__name__] += len(page)
+        connection.execute("INSERT INTO meta VALUES ('created_at', ?)", (str(time()),))
+        connection.commit()
+    finally:
+        connection.close()
+
+    os.replace(temporary_path, path)
+    return counts
+
+
+class Snapshot:
+    """
+    A snapshot file opened for reading. It's a source of instances for the cache (see ModelCache.add_source()).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, check_same_thread=False)
+        self._lock = Lock()
+        rows = self._connection.execute("SELECT value FROM meta WHERE key = 'created_at'").fetchall()
+        self.created_at = float(rows[0][0]) if rows else None
+
+    def get(self, model, instance_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT data FROM rows WHERE model = ? AND id = ?", (model.__name__, instance_id)).fetchall()
+        if not rows:
+            return None
+        return model._hydrate(json.loads(rows[0][0]))
+
+    def get_updated_at(self, model):
+        """
+        Returns the updated_at of the elements of a model, by id.
+        """
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT id, updated_at FROM rows WHERE model = ?", (model.__name__,)).fetchall())
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def revalidate(self, cache=default_cache, models=SNAPSHOT_MODELS):
+        """
+        Updates the cache with the elements that changed since the snapshot, and invalidates the ones that don't exist
+        anymore.
+        :return: the numbers of updated and removed elements
+        """
+        updated = removed = 0
+        for model in models:
+            snapshot_updated_at = self.get_updated_at(model)
+            for element in model.iter_raw():
+                if element['id'] in snapshot_updated_at \
+                        and snapshot_updated_at.pop(element['id']) == element.get('updated_at'):
+                    continue
+
+                cached = cache.get(model, element['id'])
+                if cached is not None and not cached.is_deleted():
+                    # The instances already in use are updated in place
+                    cached._set_data(**element)
+                else:
+                    cache.set(model._hydrate(element))
+                updated += 1
+
+            # The elements that aren't listed anymore have been deleted
+            for instance_id in snapshot_updated_at:
+                cache.invalidate(model, instance_id)
+                removed += 1
+
+        return updated, removed
+
+
+class SnapshotLoader:
+    """
+    Keeps a snapshot loaded as a source of the cache, revalidating it in the background.
+    """
+
+    def __init__(self, path, cache=default_cache, models=SNAPSHOT_MODELS, revalidate=True, interval=None):
+        """
+        :param path: the path of a snapshot written by dump_snapshot()
+        :param revalidate: True to revalidate the snapshot in the background once loaded
+        :param interval: the delay in seconds between two revalidations, or None to revalidate only once
+        """
+        self.snapshot = Snapshot(path)
+        self.cache = cache
+        self.models = models
+        self.interval = interval
+        self.last_error = None
+        self.revalidated = Event()
+        self._stopping = Event()
+        self._thread = None
+
+        cache.add_source(self.snapshot)
+        if revalidate:
+            self._thread = Thread(target=self._revalidate, name="vosfactures-snapshot", daemon=True)
+            self._thread.start()
+
+    def _revalidate(self):
+        while not self._stopping.is_set():
+            try:
+                self.snapshot.revalidate(self.cache, self.models)
+            except Exception as e:
+                # The snapshot keeps being used, and is revalidated again after the interval
+                self.last_error = e
+            else:
+                self.last_error = None
+            self.revalidated.set()
+
+            if self.interval is None or self._stopping.wait(self.interval):
+                return
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.cache.remove_source(self.snapshot)
+        self.snapshot.close()
+
+
+def load_snapshot(path, cache=default_cache, revalidate=True, interval=None):
+    """
+    Makes the cache read the instances it doesn't have from a snapshot file, and revalidates it in the background.
+    :return: the SnapshotLoader, to be closed to stop using the snapshot
+    """
+    return SnapshotLoader(path, cache=cache, revalidate=revalidate, interval=interval)
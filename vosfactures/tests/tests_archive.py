@@ -0,0 +1,141 @@
+import os
+import signal
+import subprocess
+import sys
+import zipfile
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from threading import Lock
+from unittest.mock import patch
+
+from vosfactures import archive
+from vosfactures.archive import export_pdfs
+from vosfactures.models import Invoice
+from vosfactures.tests.base import BaseTestCase
+
+# Exports 200 invoices, and gets killed after 150 of them
+KILLED_EXPORT_SCRIPT = """
+import os
+import signal
+import sys
+from vosfactures import archive
+from vosfactures.archive import export_pdfs
+from vosfactures.tests.tests_archive import FakeInvoice
+
+def progress(stats):
+    if stats.exported == 150:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+export_pdfs([FakeInvoice(i) for i in range(200)], sys.argv[1], workers=1, checkpoint_every=100, progress=progress)
+"""
+
+
+class FakeInvoice:
+    def __init__(self, instance_id):
+        self.id = instance_id
+
+    def download_pdf(self, path_or_fileobj, chunk_size=None):
+        path_or_fileobj.write(b'%PDF-' + str(self.id).encode() * 100)
+
+
+class ExportPdfsTest(BaseTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.dest_zip = os.path.join(self.directory.name, "invoices.zip")
+        self.downloaded = []
+        self.lock = Lock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _download(self, instance_id, chunk_size, **kwargs):
+        with self.lock:
+            self.downloaded.append(instance_id)
+        if instance_id == 13:
+            raise Exception("Unavailable")
+        return iter([b'%PDF-', str(instance_id).encode()])
+
+    def _get_invoices(self, *ids):
+        return [Invoice._hydrate({'id': instance_id}) for instance_id in ids]
+
+    @patch('vosfactures.models.download')
+    def test_export(self, mock_download):
+        mock_download.side_effect = self._download
+        progress = []
+
+        stats = export_pdfs(self._get_invoices(1, 2, 3), self.dest_zip, workers=2, checkpoint_every=2,
+                            progress=lambda s: progress.append(s.exported))
+
+        self.assertEqual(stats.exported, 3)
+        self.assertEqual(stats.bytes, 18)
+        self.assertEqual(progress, [1, 2, 3])
+        with zipfile.ZipFile(self.dest_zip) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['1.pdf', '2.pdf', '3.pdf'])
+            self.assertEqual(archive.read('2.pdf'), b'%PDF-2')
+
+    @patch('vosfactures.models.download')
+    def test_resume(self, mock_download):
+        mock_download.side_effect = self._download
+        stats = export_pdfs(self._get_invoices(1, 13), self.dest_zip)
+        self.assertEqual(stats.exported, 1)
+        self.assertEqual([invoice.id for invoice, _ in stats.failed], [13])
+
+        self.downloaded = []
+        stats = export_pdfs(self._get_invoices(1, 2, 13), self.dest_zip)
+        self.assertEqual(stats.skipped, 1)
+        self.assertEqual(stats.exported, 1)
+        self.assertEqual(sorted(self.downloaded), [2, 13])
+
+    @patch('vosfactures.models.get')
+    @patch('vosfactures.models.download')
+    def test_export_from_the_list(self, mock_download, mock_get):
+        mock_download.side_effect = self._download
+        mock_get.return_value = [{'id': 1}, {'id': 2}]
+
+        stats = Invoice.export_pdfs({'period': 'last_year'}, self.dest_zip)
+
+        mock_get.assert_called_with(json_page='invoices', action='invoices',
+                                    params={'period': 'last_year', 'page': 1, 'per_page': 100})
+        self.assertEqual(stats.exported, 2)
+
+    def test_failed_checkpoint(self):
+        spooled_files = []
+
+        class TrackedSpooledTemporaryFile(SpooledTemporaryFile):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                spooled_files.append(self)
+
+        open_segment = archive.open_segment
+
+        def open_segment_once(*args):
+            # The first checkpoint can't reopen the archive
+            if mock_open_segment.call_count > 1:
+                raise OSError("Disk full")
+            return open_segment(*args)
+
+        with patch('vosfactures.archive.SpooledTemporaryFile', TrackedSpooledTemporaryFile), \
+                patch('vosfactures.archive.open_segment', side_effect=open_segment_once) as mock_open_segment:
+            with self.assertRaisesRegex(OSError, "Disk full"):
+                export_pdfs([FakeInvoice(i) for i in range(4)], self.dest_zip, workers=2, checkpoint_every=1)
+
+        # The error isn't hidden by the cleanup, which doesn't leave any temporary file open
+        self.assertTrue(spooled_files)
+        self.assertTrue(all(spooled_file.closed for spooled_file in spooled_files))
+        with zipfile.ZipFile(self.dest_zip) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 1)
+
+    def test_resume_after_kill(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.run([sys.executable, "-c", KILLED_EXPORT_SCRIPT, self.dest_zip], env=env)
+        self.assertEqual(process.returncode, -signal.SIGKILL)
+
+        stats = export_pdfs([FakeInvoice(i) for i in range(200)], self.dest_zip, workers=2)
+
+        # The entries of the first checkpoint were kept
+        self.assertEqual(stats.skipped, 100)
+        self.assertEqual(stats.exported, 100)
+        self.assertFalse(os.path.exists(self.dest_zip + ".journal"))
+        with zipfile.ZipFile(self.dest_zip) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.namelist()), 200)
+            self.assertEqual(archive.read('42.pdf'), b'%PDF-' + b'42' * 100)
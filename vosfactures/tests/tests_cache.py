@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from vosfactures.cache import ModelCache
+from vosfactures.models import Client, Product
+
+
+class ModelCacheTest(TestCase):
+    def _get_client(self, instance_id):
+        client = Client()
+        client._set_data(id=instance_id, name="Client {}".format(instance_id))
+        return client
+
+    def test_set_and_get(self):
+        cache = ModelCache()
+        client = self._get_client(1)
+        cache.set(client)
+
+        self.assertIs(cache.get(Client, 1), client)
+        self.assertIsNone(cache.get(Client, 2))
+        # The instances are stored by model
+        self.assertIsNone(cache.get(Product, 1))
+
+    def test_invalidate(self):
+        cache = ModelCache()
+        cache.set(self._get_client(1))
+        cache.set(self._get_client(2))
+
+        cache.invalidate(Client, 1)
+        self.assertIsNone(cache.get(Client, 1))
+        self.assertEqual(len(cache), 1)
+
+        cache.invalidate(Client)
+        self.assertEqual(len(cache), 0)
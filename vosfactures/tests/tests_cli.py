@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from vosfactures.cli import ExportProgress, export, main
+from vosfactures.models import Client, Department, Invoice
+from vosfactures.tests.base import BaseTestCase
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ExportTest(BaseTestCase):
+    def setUp(self):
+        self.clients = [{'id': i, 'name': "Client {}".format(i), 'tax_no': "123456", 'kind': 'buyer',
+                         'updated_at': "2017-01-{:02d}T10:00:00".format(i % 28 + 1)} for i in range(1, 26)]
+        self.queries = []
+
+    def _get(self, params, **kwargs):
+        self.queries.append(params)
+        first = (params['page'] - 1) * params['per_page']
+        return self.clients[first:first + params['per_page']]
+
+    @patch('vosfactures.models.get')
+    def test_jsonl(self, mock_get):
+        mock_get.side_effect = self._get
+        output = io.StringIO()
+        progress = ExportProgress(stream=io.StringIO())
+
+        count = export(Client, output, 'jsonl', per_page=10, workers=3, batch_size=7, progress=progress)
+
+        self.assertEqual(count, 25)
+        self.assertEqual(progress.records, 25)
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], self.clients)
+        # The pages are queried ahead, so a few pages after the last one can be queried too
+        pages = {params['page'] for params in self.queries}
+        self.assertTrue({1, 2, 3} <= pages <= {1, 2, 3, 4, 5})
+
+    @patch('vosfactures.models.get')
+    def test_csv_since(self, mock_get):
+        mock_get.side_effect = self._get
+        output = io.StringIO()
+
+        count = export(Client, output, 'csv', since="2017-01-20", per_page=10)
+
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual(count, len(rows))
+        self.assertEqual({int(row['id']) for row in rows}, {i for i in range(1, 26) if i % 28 + 1 >= 20})
+        self.assertEqual(list(rows[0]), list(Client._field_names))
+
+    @patch('vosfactures.models.get')
+    def test_since_without_update_date(self, mock_get):
+        # The departments have no updated_at
+        with self.assertRaises(ValueError):
+            export(Department, io.StringIO(), 'csv', since="2017-01-20")
+        with self.assertRaises(SystemExit):
+            main(['export', 'departments', '--since', '2017-01-20', '--quiet'])
+        self.assertFalse(mock_get.called)
+
+    @patch('vosfactures.models.get')
+    def test_invoices_since(self, mock_get):
+        invoice = {'id': 1, 'title': "Invoice", 'issue_date': "2017-01-27",
+                   'positions': [{'product_id': 1, 'quantity': 2}]}
+        mock_get.return_value = [invoice]
+        output = io.StringIO()
+
+        export(Invoice, output, 'csv', since="2017-01-01", params={'kind': "vat"}, workers=1)
+
+        params = mock_get.call_args[1]['params']
+        self.assertEqual(params['period'], "more")
+        self.assertEqual(params['date_from'], "2017-01-01")
+        self.assertEqual(params['kind'], "vat")
+        row = next(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual(json.loads(row['positions']), invoice['positions'])
+
+    @unittest.skipIf(pyarrow is None, "pyarrow isn't installed")
+    @patch('vosfactures.models.get')
+    def test_parquet(self, mock_get):
+        mock_get.side_effect = self._get
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "clients.parquet")
+            main(['export', 'clients', '--format', 'parquet', '--output', path, '--per-page', '10', '--batch-size',
+                  '10', '--quiet'])
+
+            table = pyarrow.parquet.read_table(path)
+            self.assertEqual(table.num_rows, 25)
+            self.assertEqual(table.column('id').to_pylist(), list(range(1, 26)))
+            self.assertEqual(table.column('name').to_pylist()[0], "Client 1")
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+CHECK_SCRIPT = """
+import sys
+import vosfactures.models
+HEAVY_MODULES = ("requests", "django", "vosfactures.local_settings", "concurrent.futures")
+print(",".join(name for name in HEAVY_MODULES if name in sys.modules))
+"""
+
+
+class LazyImportTest(TestCase):
+    def test_heavy_dependencies_are_not_imported_with_the_models(self):
+        # A new interpreter is needed, as the current one may have imported them already
+        output = subprocess.check_output([sys.executable, "-c", CHECK_SCRIPT], universal_newlines=True)
+        self.assertEqual(output.strip(), "")
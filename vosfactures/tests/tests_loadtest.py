@@ -0,0 +1,92 @@
+import io
+import json
+from time import monotonic
+from unittest.mock import patch
+
+from vosfactures.cli import main
+from vosfactures.loadtest import FakeApi, LatencyProfile, RateLimiter, get_percentile, run_load_test
+from vosfactures.models import Client, Invoice, Product, Status
+from vosfactures.tests.base import BaseTestCase
+
+
+class FakeApiTest(BaseTestCase):
+    def test_models_against_fake_api(self):
+        with FakeApi() as fake_api:
+            product = Product.create(name="Product", price_net="10.00", tax=20)
+            client = Client.create(name="Client")
+            invoice = Invoice.create(title="Invoice", issue_date="2017-01-27", department_id=1, client_id=client.id,
+                                     positions=[{'product_id': product.id, 'quantity': 2}])
+            invoice.set_status(Status.paid)
+
+            self.assertEqual(Invoice.get(invoice.id).status, Status.paid)
+            self.assertEqual([element.id for element in Client.list()], [client.id])
+            invoice.delete()
+            self.assertEqual(Invoice.list(), [])
+
+        self.assertEqual(fake_api.requests_count, 8)
+
+    def test_latency_profile(self):
+        profile = LatencyProfile({"POST invoices": [0.2, 0.3], "*": 0.1}, seed=1)
+        self.assertIn(profile.get_latency("POST", "invoices"), (0.2, 0.3))
+        self.assertEqual(profile.get_latency("GET", "invoices"), 0.1)
+        self.assertEqual(LatencyProfile().get_latency("GET", "clients"), 0.)
+
+
+class LoadTestTest(BaseTestCase):
+    def test_run_load_test(self):
+        with FakeApi():
+            report = run_load_test(iterations=6, concurrency=3)
+
+        self.assertEqual(report.scenarios, 6)
+        self.assertEqual(report.failed_scenarios, 0)
+        stats = report.as_dict()
+        self.assertEqual(stats["Product.create"]['count'], 12)
+        self.assertEqual(stats["Invoice.set_status"]['count'], 6)
+        self.assertEqual(stats["Client.delete"]['error_rate'], 0.)
+        self.assertGreater(stats["Invoice.create"]['throughput'], 0)
+        self.assertLessEqual(stats["Invoice.create"]['p50'], stats["Invoice.create"]['p99'])
+
+    def test_errors(self):
+        with FakeApi(error_rate=1.):
+            report = run_load_test(iterations=3, concurrency=2)
+
+        # Each scenario stops at its first failed call
+        self.assertEqual(report.failed_scenarios, 3)
+        self.assertEqual(report.as_dict(), {"Product.create": dict(
+            report.as_dict()["Product.create"], count=3, errors=3, error_rate=1.)})
+
+    def test_failed_scenario_deletes_the_created_objects(self):
+        with FakeApi():
+            with patch.object(Invoice, 'set_status', side_effect=Exception("API unavailable")):
+                report = run_load_test(iterations=1, concurrency=1)
+
+            self.assertEqual((Product.list(), Client.list(), Invoice.list()), ([], [], []))
+
+        self.assertEqual(report.failed_scenarios, 1)
+        stats = report.as_dict()
+        self.assertEqual(stats["Invoice.set_status"]['errors'], 1)
+        self.assertEqual(stats["Invoice.delete"]['count'], 1)
+        self.assertEqual(stats["Client.delete"]['count'], 1)
+        self.assertEqual(stats["Product.delete"]['count'], 2)
+        self.assertEqual(stats["Product.delete"]['errors'], 0)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=100)
+        start = monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(monotonic() - start, 0.095)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([3], 95), 3)
+        self.assertEqual(get_percentile([], 95), 0.)
+
+    def test_command(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            main(['loadtest', '--iterations', '2', '--concurrency', '2', '--json'])
+
+        stats = json.loads(stdout.getvalue())
+        self.assertEqual(stats["Invoice.delete"]['count'], 2)
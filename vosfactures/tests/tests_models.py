@@ -1,9 +1,15 @@
+import hashlib
+import os
+from io import BytesIO
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
 from vosfactures import settings
+from vosfactures.cache import default_cache
 from vosfactures.models import Client, Department, Invoice, ObjectIsDeletedError, Product, BaseData, Status, \
-    CommandUnavailable
+    CommandUnavailable, DownloadError
 from vosfactures.tests.base import BaseTestCase
+from vosfactures.utils import HttpError
 
 
 # Sample model, used to test the behaviours of BaseData
@@ -91,6 +97,15 @@ class BaseDataTest(BaseTestCase):
         with self.assertRaises(CommandUnavailable):
             e.delete()
 
+    def test_available_commands_changed_in_place(self):
+        self.assertFalse(ExampleForbiddenModel._is_command_available('get'))
+        settings.AVAILABLE_COMMANDS['ExampleForbiddenModel'].append('get')
+        try:
+            self.assertTrue(ExampleForbiddenModel._is_command_available('get'))
+        finally:
+            settings.AVAILABLE_COMMANDS['ExampleForbiddenModel'].remove('get')
+        self.assertFalse(ExampleForbiddenModel._is_command_available('get'))
+
     @patch('vosfactures.models.get')
     def test_get(self, mock_get):
         mock_get.return_value = self.test_data
@@ -193,6 +208,76 @@ class BaseDataTest(BaseTestCase):
         with self.assertRaises(ObjectIsDeletedError):
             el.delete()
 
+    @patch('vosfactures.models.get')
+    def test_list_with_filters(self, mock_get):
+        mock_get.return_value = [self.test_data, self._get_updated_test_data(id=2)]
+
+        elements = ExampleModel.list(period="this_month")
+        mock_get.assert_called_with(json_page='page', action='actions', params={'period': 'this_month'})
+
+        self.assertEqual([el.id for el in elements], [1, 2])
+
+    @patch('vosfactures.models.get')
+    def test_iter_list_queries_pages_until_a_partial_one(self, mock_get):
+        mock_get.side_effect = [
+            [self._get_updated_test_data(id=1), self._get_updated_test_data(id=2)],
+            [self._get_updated_test_data(id=3)],
+        ]
+
+        elements = list(ExampleModel.iter_list(per_page=2))
+
+        self.assertEqual([el.id for el in elements], [1, 2, 3])
+        mock_get.assert_called_with(json_page='page', action='actions', params={'page': 2, 'per_page': 2})
+
+    @patch('vosfactures.models.get')
+    def test_get_many_uses_the_cache(self, mock_get):
+        default_cache.clear()
+        mock_get.return_value = self.test_data
+
+        first = ExampleModel.get_many([1, 1, None])
+        second = ExampleModel.get_many([1])
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIs(first[1], second[1])
+        default_cache.clear()
+
+    @patch('vosfactures.models.get')
+    def test_get_many_loads_several_instances_from_the_list(self, mock_get):
+        default_cache.clear()
+        mock_get.return_value = [self._get_updated_test_data(id=i) for i in range(1, 4)]
+
+        instances = ExampleModel.get_many([1, 3])
+
+        self.assertEqual(sorted(instances), [1, 3])
+        self.assertEqual(mock_get.call_count, 1)
+        default_cache.clear()
+
+    def test_schema(self):
+        self.assertEqual(ExampleModel._field_names, ('id', 'title', 'description', 'author', 'active', 'creation_date'))
+        self.assertEqual(ExampleModel._auto_fields, {'creation_date'})
+        self.assertEqual(ExampleForbiddenCommandsModel._forbidden, {'get', 'list', 'create', 'update', 'delete'})
+        # The properties aren't fields
+        self.assertNotIn('client', Invoice._fields)
+
+    def test_set_data_discards_unknown_keys(self):
+        el = ExampleModel()
+        el._set_data(title="A title", unknown="value", _is_deleted=True)
+
+        self.assertEqual(el.title, "A title")
+        self.assertFalse(hasattr(el, 'unknown'))
+        self.assertFalse(el.is_deleted())
+        # The assigned data isn't considered as modified
+        self.assertFalse(el.is_dirty())
+
+    def test_auto_data_cant_be_assigned(self):
+        el = ExampleModel()
+        with self.assertRaises(Exception):
+            el.creation_date = '2017-04-06T16:26:59.745+02:00'
+
+    def test_prefetch_unknown_relationship(self):
+        with self.assertRaises(ValueError):
+            ExampleModel._prefetch([ExampleModel()], ['author'])
+
 
 class ClientTest(BaseTestCase):
     test_data = {
@@ -329,8 +414,8 @@ class InvoiceTest(BaseTestCase):
         self.assertEqual(str(el), "1 : 2017-09 (797.73 EUR)")
 
     @patch('vosfactures.models.get')
-    @patch('vosfactures.models.Invoice.update')
-    def test_set_status(self, mock_invoice_update, mock_get):
+    @patch('vosfactures.models.query')
+    def test_set_status(self, mock_query, mock_get):
         mock_get.return_value = self.test_data
 
         el = Invoice.get(instance_id=1)
@@ -338,7 +423,149 @@ class InvoiceTest(BaseTestCase):
         self.assertNotEqual(el.status, Status.sent)
         el.set_status(Status.sent)
         self.assertEqual(el.status, Status.sent)
-        mock_invoice_update.assert_called_with()
+        self.assertFalse(el.is_dirty())
+        # Without the change_status command, only the status is updated, and the result isn't read
+        mock_query.assert_called_once_with(method="PUT", json_page="invoices", action="invoice", instance_id=1,
+                                           status=Status.sent)
+        self.assertEqual(mock_get.call_count, 1)
+
+        el.set_status(Status.paid, paid_date="2017-01-27", refresh=True)
+        mock_query.assert_called_with(method="PUT", json_page="invoices", action="invoice", instance_id=1,
+                                      status=Status.paid, paid_date="2017-01-27")
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('vosfactures.models.query')
+    def test_failed_set_status(self, mock_query):
+        mock_query.side_effect = HttpError("Error 500")
+        el = Invoice._hydrate(dict(self.test_data, id=12, status=Status.issued))
+        el.paid_date = "2017-01-27"
+
+        with self.assertRaises(HttpError):
+            el.set_status(Status.paid, paid_date="2017-01-27")
+        # The invoice is unchanged, and its updated fields are still sent by the next update
+        self.assertEqual(el.status, Status.issued)
+        self.assertEqual(el._updated_fields, ['paid_date'])
+
+    @patch('vosfactures.models.query')
+    def test_set_status_with_change_status_endpoint(self, mock_query):
+        commands = dict(settings.AVAILABLE_COMMANDS, Invoice=['get', 'update', 'change_status'])
+        with patch.object(settings, 'AVAILABLE_COMMANDS', commands):
+            el = Invoice._hydrate(dict(self.test_data, id=12))
+            el.set_status(Status.paid)
+
+        self.assertEqual(el.status, Status.paid)
+        mock_query.assert_called_once_with(method="POST", json_page="invoices/12/change_status", action="invoice",
+                                           params={'status': Status.paid})
+
+    @patch('vosfactures.models.query')
+    def test_bulk_set_status(self, mock_query):
+        def query(instance_id, **kwargs):
+            if instance_id == 2:
+                raise HttpError("Error 404")
+        mock_query.side_effect = query
+
+        invoice = Invoice._hydrate(dict(self.test_data, id=3))
+        results = Invoice.bulk_set_status([1, 2, invoice], Status.paid, workers=2)
+
+        self.assertEqual([result.id for result in results], [1, 2, 3])
+        self.assertEqual([result.error is None for result in results], [True, False, True])
+        self.assertIsInstance(results[1].error, HttpError)
+        self.assertNotEqual(results[1].invoice.status, Status.paid)
+        self.assertIs(results[2].invoice, invoice)
+        self.assertEqual(invoice.status, Status.paid)
+        self.assertEqual(mock_query.call_count, 3)
+
+    @patch('vosfactures.models.get')
+    def test_list_with_prefetch(self, mock_get):
+        default_cache.clear()
+        invoices_data = [
+            dict(self.test_data, id=i, client_id=i % 2 + 1, positions=[{'product_id': 7, 'quantity': 1}])
+            for i in range(1, 6)]
+        responses = {
+            'invoices': invoices_data,
+            'clients': [dict(ClientTest.test_data, id=1), dict(ClientTest.test_data, id=2)],
+            'product': dict(ProductTest.test_data, id=7),
+            'department': DepartmentTest.test_data,
+        }
+        mock_get.side_effect = lambda action, **kwargs: responses[action]
+
+        invoices = Invoice.list(prefetch=['client', 'department', 'products'])
+        self.assertEqual(mock_get.call_count, 4)
+
+        # The relationships are now read from the cache
+        self.assertEqual([invoice.client.id for invoice in invoices], [2, 1, 2, 1, 2])
+        self.assertEqual(invoices[0].department.id, 1)
+        self.assertEqual([product.id for product in invoices[0].products], [7])
+        self.assertEqual(mock_get.call_count, 4)
+        default_cache.clear()
+
+    @patch('vosfactures.models.get')
+    def test_list_with_a_missing_client(self, mock_get):
+        default_cache.clear()
+        responses = {
+            'invoices': [dict(self.test_data, id=i, client_id=i) for i in range(1, 3)],
+            'clients': [dict(ClientTest.test_data, id=1)],
+        }
+
+        def get(action, **kwargs):
+            if action == 'client':
+                # The client 2 has been deleted
+                raise HttpError("Error 404")
+            return responses[action]
+
+        mock_get.side_effect = get
+        invoices = Invoice.list(prefetch=['client'])
+
+        self.assertEqual(invoices[0].client.id, 1)
+        self.assertIsNone(invoices[1].client)
+        default_cache.clear()
+
+    @patch('vosfactures.models.get')
+    def test_lazy_relationship(self, mock_get):
+        default_cache.clear()
+        mock_get.return_value = ClientTest.test_data
+
+        invoice = Invoice()
+        invoice._set_data(**self.test_data)
+        self.assertEqual(invoice.client.name, "Company name")
+        mock_get.assert_called_with(json_page='clients', action='client', instance_id=1)
+        default_cache.clear()
+
+    @patch('vosfactures.models.download')
+    def test_download_pdf_to_file_object(self, mock_download):
+        mock_download.return_value = iter([b'%PDF-1.4', b' content'])
+        invoice = Invoice._hydrate(self.test_data)
+        fileobj = BytesIO()
+
+        size = invoice.download_pdf(fileobj, chunk_size=8, expected_size=16,
+                                    checksum=hashlib.sha256(b'%PDF-1.4 content').hexdigest())
+
+        mock_download.assert_called_with(json_page='invoices', instance_id=1, extension='pdf', chunk_size=8)
+        self.assertEqual(size, 16)
+        self.assertEqual(fileobj.getvalue(), b'%PDF-1.4 content')
+
+    @patch('vosfactures.models.download')
+    def test_download_pdf_to_path(self, mock_download):
+        mock_download.return_value = iter([b'%PDF-1.4', b' content'])
+        invoice = Invoice._hydrate(self.test_data)
+
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "invoice.pdf")
+            invoice.download_pdf(path)
+            with open(path, 'rb') as pdf:
+                self.assertEqual(pdf.read(), b'%PDF-1.4 content')
+
+    @patch('vosfactures.models.download')
+    def test_download_pdf_wrong_checksum(self, mock_download):
+        mock_download.return_value = iter([b'%PDF-1.4', b' content'])
+        invoice = Invoice._hydrate(self.test_data)
+
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "invoice.pdf")
+            with self.assertRaises(DownloadError):
+                invoice.download_pdf(path, checksum="0123456789abcdef")
+            # No partial file is left
+            self.assertEqual(os.listdir(directory), [])
 
     def test_forbidden_commands(self):
         self.assertNotIn('get', Invoice._forbidden_commands)
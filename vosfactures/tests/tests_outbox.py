@@ -0,0 +1,205 @@
+import os
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import time
+from unittest.mock import MagicMock, patch
+
+from vosfactures.models import Client, Invoice, Status
+from vosfactures.outbox import DONE, FAILED, Outbox, OutboxError
+from vosfactures.tests.base import BaseTestCase
+
+
+class OutboxTest(BaseTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "outbox.sqlite")
+        self.patcher = patch('vosfactures.utils.query')
+        self.mock_query = self.patcher.start()
+        self.mock_query.side_effect = self._query
+        self.queries = []
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def _query(self, method, action, instance_id=None, json_page=None, **kwargs):
+        self.queries.append((method, instance_id, kwargs))
+        if method == "POST":
+            return dict(kwargs, id=42)
+        return dict(kwargs, id=instance_id)
+
+    def test_writes_are_queued_then_sent(self):
+        with Outbox(self.path, retry_backoff=0) as outbox:
+            client = Client.create(name="Client")
+            # Nothing has been sent yet, but the instance can already be used
+            self.assertIsNone(client.id)
+            client.email = "contact@domain.xyz"
+            client.update()
+            client.delete()
+
+            self.assertTrue(outbox.drain(timeout=5))
+
+        self.assertEqual(self.queries, [
+            ("POST", None, {'name': "Client"}),
+            ("PUT", 42, {'email': "contact@domain.xyz"}),
+            ("DELETE", 42, {}),
+        ])
+        self.assertTrue(client.is_deleted())
+        self.assertIsNone(Client._outbox)
+
+    def test_handle(self):
+        with Outbox(self.path) as outbox:
+            client = Client.create(name="Client")
+            self.assertEqual(client.last_write().wait(timeout=5)['id'], 42)
+            self.assertEqual(client.last_write().status, DONE)
+            # The instance got the data returned by the API
+            self.assertEqual(client.id, 42)
+            self.assertTrue(outbox.drain(timeout=5))
+
+    def test_set_status_is_queued(self):
+        invoice = Invoice._hydrate({'id': 7, 'status': Status.issued})
+        with Outbox(self.path) as outbox:
+            invoice.set_status(Status.paid)
+            invoice.last_write().wait(timeout=5)
+
+        self.assertEqual(self.queries, [("PUT", 7, {'status': Status.paid})])
+
+    def test_writes_of_new_objects_keep_the_cache(self):
+        cached = Client._hydrate({'id': 5, 'name': "Cached client"})
+        source = MagicMock()
+        source.get.side_effect = lambda model, instance_id: cached if instance_id == 5 else None
+        Client._cache.add_source(source)
+        try:
+            with Outbox(self.path) as outbox:
+                client = Client.create(name="Client")
+                client.email = "contact@domain.xyz"
+                client.update()
+                client.delete()
+                self.assertTrue(outbox.drain(timeout=5))
+
+            # The other instances of the model are still read from the source
+            self.assertIs(Client._cache.get(Client, 5), cached)
+        finally:
+            Client._cache.remove_source(source)
+            Client._cache.clear()
+
+    def test_retries_then_fails(self):
+        self.mock_query.side_effect = Exception("API unavailable")
+        with Outbox(self.path, max_attempts=2, retry_backoff=0, poll_interval=0.01) as outbox:
+            handle = Client.create(name="Client").last_write()
+            with self.assertRaises(OutboxError):
+                handle.wait(timeout=5)
+
+        self.assertEqual(handle.status, FAILED)
+        self.assertEqual(self.mock_query.call_count, 2)
+
+    def test_consecutive_updates_are_merged(self):
+        client = Client._hydrate({'id': 3, 'name': "Client"})
+        outbox = Outbox(self.path)
+        outbox.install()
+        try:
+            client.name = "New name"
+            client.update()
+            client.email = "contact@domain.xyz"
+            client.update()
+        finally:
+            outbox.uninstall()
+
+        outbox.start()
+        self.assertTrue(outbox.drain(timeout=5))
+        outbox.stop()
+
+        self.assertEqual(self.queries, [("PUT", 3, {'name': "New name", 'email': "contact@domain.xyz"})])
+
+    def test_objects_waiting_for_a_retry_dont_hold_back_the_others(self):
+        waiting = Client._hydrate({'id': 3, 'name': "Waiting"})
+        other = Client._hydrate({'id': 4, 'name': "Other"})
+        outbox = Outbox(self.path, batch_size=2)
+        outbox.install()
+        try:
+            waiting.name = "New name"
+            waiting.update()
+            waiting.delete()
+            other.name = "New name"
+            handle = other.update().last_write()
+        finally:
+            outbox.uninstall()
+        outbox._execute("UPDATE operations SET next_attempt_at = ? WHERE object_key = 'Client:3'", time() + 60)
+
+        outbox.start()
+        try:
+            handle.wait(timeout=5)
+            self.assertEqual(outbox.pending_count(), 2)
+        finally:
+            outbox.close()
+        self.assertEqual(self.queries, [("PUT", 4, {'name': "New name"})])
+
+    def test_purge(self):
+        with Outbox(self.path, retention=None) as outbox:
+            handle = Client.create(name="Client").last_write()
+            handle.wait(timeout=5)
+            # The events of the finished writes aren't kept
+            self.assertEqual(outbox._events, {})
+            self.assertTrue(outbox.drain(timeout=5))
+
+            self.assertEqual(outbox.purge(older_than=60), 0)
+            self.assertEqual(outbox.purge(), 1)
+            with self.assertRaises(OutboxError):
+                handle.status
+
+    def test_purge_keeps_the_objects_with_pending_writes(self):
+        outbox = Outbox(self.path)
+        outbox.install()
+        try:
+            client = Client.create(name="Client")
+            client.name = "New name"
+            client.update()
+        finally:
+            outbox.uninstall()
+        # The creation is done, but the update still needs the id it returned
+        outbox._execute("UPDATE operations SET status = ?, result = ?, finished_at = 0 WHERE method = 'POST'",
+                        DONE, '{"id": 42}')
+
+        self.assertEqual(outbox.purge(), 0)
+        outbox.start()
+        self.assertTrue(outbox.drain(timeout=5))
+        outbox.close()
+        self.assertEqual(self.queries, [("PUT", 42, {'name': "New name"})])
+
+    def test_writes_are_durable(self):
+        outbox = Outbox(self.path)
+        outbox.install()
+        try:
+            Client.create(name="Client")
+        finally:
+            outbox.uninstall()
+        # The process could end here : the write is sent by the next outbox using the same database
+        outbox.close()
+
+        outbox = Outbox(self.path)
+        self.assertEqual(outbox.pending_count(), 1)
+        outbox.start()
+        self.assertTrue(outbox.drain(timeout=5))
+        outbox.close()
+        self.assertEqual(self.queries, [("POST", None, {'name': "Client"})])
+
+    def test_writes_of_different_objects_are_concurrent(self):
+        release = Event()
+        started = []
+
+        def query(method, **kwargs):
+            started.append(method)
+            release.wait(5)
+            return {'id': len(started)}
+
+        self.mock_query.side_effect = query
+        with Outbox(self.path, workers=2) as outbox:
+            Client.create(name="First")
+            Client.create(name="Second")
+            for _ in range(500):
+                if len(started) == 2:
+                    break
+                release.wait(0.01)
+            self.assertEqual(len(started), 2)
+            release.set()
+            self.assertTrue(outbox.drain(timeout=5))
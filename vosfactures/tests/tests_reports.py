@@ -0,0 +1,75 @@
+import random
+from decimal import Decimal
+from unittest import skipIf
+from unittest.mock import patch
+
+from vosfactures.models import DocumentKind, Invoice, Status
+from vosfactures.reports import GroupTotals, aggregate, aggregate_invoices
+from vosfactures.tests.base import BaseTestCase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AggregateTest(BaseTestCase):
+    invoices = [
+        {'id': 1, 'client_id': 1, 'issue_date': '2017-04-07', 'kind': DocumentKind.bill, 'status': Status.paid,
+         'price_net': '100.0', 'price_gross': '120.0', 'paid': '120.0'},
+        {'id': 2, 'client_id': 1, 'issue_date': '2017-04-20', 'kind': DocumentKind.bill, 'status': Status.partial,
+         'price_net': '50.5', 'price_gross': '60.6', 'paid': '10,00'},
+        {'id': 3, 'client_id': 2, 'issue_date': '2017-05-02', 'kind': DocumentKind.estimate, 'status': Status.issued,
+         'price_net': '10', 'price_gross': '12', 'paid': None},
+    ]
+
+    def test_group_by_client(self):
+        report = aggregate(iter(self.invoices), use_numpy=False)
+
+        self.assertEqual(sorted(report), [(1,), (2,)])
+        self.assertEqual(report[(1,)], GroupTotals(2, 15050, 18060, 13000))
+        self.assertEqual(report[(1,)].outstanding, Decimal('50.60'))
+
+    def test_group_by_several_fields(self):
+        report = aggregate(self.invoices, group_by=('month', 'kind', lambda invoice: invoice['id'] > 1),
+                           use_numpy=False)
+
+        self.assertEqual(sorted(report), [('2017-04', 'vat', False), ('2017-04', 'vat', True),
+                                          ('2017-05', 'estimate', True)])
+
+    def test_instances(self):
+        invoices = [Invoice._hydrate(invoice) for invoice in self.invoices]
+        report = aggregate(invoices, group_by=('status',), use_numpy=False)
+
+        self.assertEqual(report[(Status.issued,)].price_gross, Decimal('12.00'))
+
+    @patch('vosfactures.models.get')
+    def test_instances_by_relation(self, mock_get):
+        # The relationships of the invoices (like invoice.client) aren't loaded
+        mock_get.side_effect = Exception("The API shouldn't be queried")
+        invoices = [Invoice._hydrate(invoice) for invoice in self.invoices]
+
+        report = aggregate(invoices, group_by=('client', 'department'), use_numpy=False)
+
+        self.assertEqual(report[(1, None)].count, 2)
+        mock_get.assert_not_called()
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        generator = random.Random(1)
+        invoices = [{'client_id': generator.randint(1, 30), 'issue_date': '2017-{:02d}-01'.format(generator.randint(1, 12)),
+                     'price_net': "{:.2f}".format(generator.uniform(0, 1000)),
+                     'price_gross': "{:.2f}".format(generator.uniform(0, 1000)),
+                     'paid': generator.choice(['0,00', '12.5', None])} for _ in range(2000)]
+
+        expected = aggregate(invoices, group_by=('client', 'month'), use_numpy=False)
+        self.assertEqual(aggregate(invoices, group_by=('client', 'month'), use_numpy=True, chunk_size=300), expected)
+
+    @patch('vosfactures.models.get')
+    def test_aggregate_invoices(self, mock_get):
+        mock_get.return_value = self.invoices
+
+        report = aggregate_invoices(group_by=('kind',), use_numpy=False, period='this_year')
+        mock_get.assert_called_with(json_page='invoices', action='invoices',
+                                    params={'period': 'this_year', 'page': 1, 'per_page': 100})
+        self.assertEqual(report[(DocumentKind.bill,)].count, 2)
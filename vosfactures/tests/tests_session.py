@@ -0,0 +1,103 @@
+from unittest.mock import patch
+
+from vosfactures.models import Client, Invoice, Product
+from vosfactures.session import FlushError, Session, get_rank
+from vosfactures.tests.base import BaseTestCase
+
+
+class SessionTest(BaseTestCase):
+    @patch('vosfactures.models.get')
+    def test_identity_map(self, mock_get):
+        mock_get.return_value = {'id': 1, 'name': "Client"}
+        session = Session()
+
+        self.assertIs(session.get(Client, 1), session.get(Client, 1))
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('vosfactures.models.get')
+    def test_merge_keeps_unflushed_changes(self, mock_get):
+        mock_get.return_value = [{'id': 1, 'name': "Client", 'email': "old@domain.xyz"}]
+        session = Session()
+        client, = session.list(Client)
+        client.name = "New name"
+
+        mock_get.return_value = [{'id': 1, 'name': "Client", 'email': "new@domain.xyz"}]
+        same_client, = session.list(Client)
+
+        self.assertIs(same_client, client)
+        self.assertEqual(client.name, "New name")
+        self.assertEqual(client.email, "new@domain.xyz")
+        self.assertEqual(session.dirty, [client])
+
+    def test_rank(self):
+        self.assertEqual(get_rank(Product), 0)
+        self.assertEqual(get_rank(Invoice), 1)
+
+    @patch('vosfactures.models.put')
+    @patch('vosfactures.models.post')
+    def test_flush_creates_the_referenced_objects_first(self, mock_post, mock_put):
+        created = []
+
+        def post(action, **kwargs):
+            created.append(action)
+            return dict(kwargs, id=len(created))
+
+        mock_post.side_effect = post
+        session = Session()
+        product = session.create(Product, name="Product", price_net=10, tax=20)
+        invoice = session.create(Invoice, title="Invoice", issue_date="2017-01-01", department_id=1, client_id=1,
+                                 positions=[{"product_id": product, "quantity": 2}])
+        session.flush()
+
+        self.assertEqual(created, ['product', 'invoice'])
+        self.assertEqual(invoice.positions, [{"product_id": product.id, "quantity": 2}])
+        self.assertEqual(session.new, [])
+        self.assertFalse(mock_put.called)
+
+    @patch('vosfactures.models.delete')
+    @patch('vosfactures.models.put')
+    @patch('vosfactures.models.get')
+    def test_flush_updates_and_deletes(self, mock_get, mock_put, mock_delete):
+        mock_get.side_effect = lambda instance_id, **kwargs: {'id': instance_id, 'name': "Client"}
+        mock_put.side_effect = lambda instance_id, **kwargs: dict(kwargs, id=instance_id)
+        session = Session()
+        updated = session.get(Client, 1)
+        deleted = session.get(Client, 2)
+        updated.name = "New name"
+        session.delete(deleted)
+        session.flush()
+
+        mock_put.assert_called_once_with(json_page='clients', action='client', instance_id=1, name="New name")
+        mock_delete.assert_called_once_with(json_page='clients', action='client', instance_id=2)
+        self.assertTrue(deleted.is_deleted())
+        self.assertEqual(session.dirty, [])
+        self.assertEqual(session.deleted, [])
+
+    @patch('vosfactures.models.post')
+    def test_failed_flush_keeps_the_changes(self, mock_post):
+        mock_post.side_effect = Exception("API unavailable")
+        session = Session()
+        client = session.create(Client, name="Client")
+
+        with self.assertRaises(FlushError):
+            session.flush()
+        self.assertEqual(session.new, [client])
+
+    @patch('vosfactures.models.put')
+    @patch('vosfactures.models.get')
+    def test_failed_update_keeps_the_changes(self, mock_get, mock_put):
+        mock_get.return_value = {'id': 1, 'name': "Client"}
+        mock_put.side_effect = Exception("API unavailable")
+        session = Session()
+        client = session.get(Client, 1)
+        client.name = "New name"
+
+        with self.assertRaises(FlushError):
+            session.flush()
+        self.assertEqual(session.dirty, [client])
+
+        # The update is sent again by the next flush
+        mock_put.side_effect = lambda instance_id, **kwargs: dict(kwargs, id=instance_id)
+        session.flush()
+        mock_put.assert_called_with(json_page='clients', action='client', instance_id=1, name="New name")
+        self.assertEqual(session.dirty, [])
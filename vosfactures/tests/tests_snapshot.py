@@ -0,0 +1,98 @@
+import os
+from tempfile import TemporaryDirectory
+
+from vosfactures.cache import ModelCache
+from vosfactures.loadtest import FakeApi
+from vosfactures.models import Client, Department, Product
+from vosfactures.snapshot import Snapshot, dump_snapshot, load_snapshot
+from vosfactures.tests.base import BaseTestCase
+from vosfactures.utils import post
+
+
+class SnapshotTest(BaseTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "catalog.sqlite")
+        self.fake_api = FakeApi()
+        self.fake_api.install()
+
+        self.products = [Product.create(name="Product {}".format(i), price_net="10.00", tax=20) for i in range(3)]
+        self.client = Client.create(name="Client")
+        # The departments can't be created through the model
+        self.department = Department._hydrate(post(json_page="departments", action="department", name="Department"))
+
+    def tearDown(self):
+        self.fake_api.uninstall()
+        self.directory.cleanup()
+
+    def test_dump_and_read(self):
+        self.assertEqual(dump_snapshot(self.path), {'Product': 3, 'Client': 1, 'Department': 1})
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+        snapshot = Snapshot(self.path)
+        self.assertEqual(len(snapshot), 5)
+        product = snapshot.get(Product, self.products[1].id)
+        self.assertIsInstance(product, Product)
+        self.assertEqual(product.name, "Product 1")
+        self.assertIsNone(snapshot.get(Client, self.products[1].id))
+        snapshot.close()
+
+    def test_cache_source(self):
+        dump_snapshot(self.path)
+        cache = ModelCache()
+        loader = load_snapshot(self.path, cache=cache, revalidate=False)
+        requests_count = self.fake_api.requests_count
+
+        # Read from the snapshot without any query, then kept in memory
+        product = cache.get(Product, self.products[0].id)
+        self.assertEqual(product.name, "Product 0")
+        self.assertIs(cache.get(Product, self.products[0].id), product)
+        self.assertEqual(cache.get(Client, self.client.id).name, "Client")
+        self.assertEqual(self.fake_api.requests_count, requests_count)
+
+        # The invalidated instances aren't read from the snapshot again
+        cache.invalidate(Client, self.client.id)
+        self.assertIsNone(cache.get(Client, self.client.id))
+        cache.invalidate(Department)
+        self.assertIsNone(cache.get(Department, self.department.id))
+
+        # Even once the cache is cleared
+        cache.clear()
+        self.assertIsNone(cache.get(Client, self.client.id))
+        self.assertIsNone(cache.get(Department, self.department.id))
+        self.assertEqual(cache.get(Product, self.products[0].id).name, "Product 0")
+
+        loader.close()
+        self.assertIsNone(cache.get(Product, self.products[1].id))
+
+    def test_get_cached(self):
+        dump_snapshot(self.path)
+        loader = load_snapshot(self.path, revalidate=False)
+        try:
+            requests_count = self.fake_api.requests_count
+            self.assertEqual(Product.get(self.products[2].id, cached=True).name, "Product 2")
+            self.assertEqual(self.fake_api.requests_count, requests_count)
+            # Without cached=True, the API is queried
+            Product.get(self.products[2].id)
+            self.assertEqual(self.fake_api.requests_count, requests_count + 1)
+        finally:
+            loader.close()
+            Product._cache.clear()
+
+    def test_revalidation(self):
+        dump_snapshot(self.path)
+        self.products[0].name = "Renamed product"
+        self.products[0].update()
+        self.client.delete()
+        new_product = Product.create(name="New product", price_net="5.00", tax=20)
+
+        cache = ModelCache()
+        loader = load_snapshot(self.path, cache=cache)
+        self.assertTrue(loader.revalidated.wait(timeout=5))
+        self.assertIsNone(loader.last_error)
+
+        self.assertEqual(cache.get(Product, self.products[0].id).name, "Renamed product")
+        self.assertEqual(cache.get(Product, self.products[1].id).name, "Product 1")
+        self.assertEqual(cache.get(Product, new_product.id).name, "New product")
+        self.assertIsNone(cache.get(Client, self.client.id))
+        loader.close()
@@ -0,0 +1,82 @@
+import random
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch
+
+from vosfactures.cache import default_cache
+from vosfactures.models import Invoice, Product
+from vosfactures.totals import compute_totals, compute_totals_batch, get_strategy
+
+
+def get_product(instance_id, price_net, tax, price_gross=None):
+    return Product._hydrate(dict(id=instance_id, name="Product", price_net=price_net, tax=tax, price_gross=price_gross))
+
+
+class ComputeTotalsTest(TestCase):
+    def assertTotals(self, totals, net, tax, gross):
+        self.assertEqual((totals.price_net, totals.price_tax, totals.price_gross),
+                         (Decimal(net), Decimal(tax), Decimal(gross)))
+
+    def test_net_prices(self):
+        products = [get_product(1, '10.0', '20'), get_product(2, '0.333', '20')]
+        totals = compute_totals([{'product_id': 1, 'quantity': 3}, {'product_id': 2, 'quantity': 3}], products)
+
+        self.assertTotals(totals, '31.00', '6.20', '37.20')
+        self.assertEqual(totals.lines[1], (Decimal('1.00'), Decimal('0.20'), Decimal('1.20')))
+
+    def test_position_strategies(self):
+        positions = [{'price_net': '1.04', 'quantity': 3, 'tax': '5.5'}]
+
+        self.assertTotals(compute_totals(positions, calculating_strategy="default"), '3.12', '0.17', '3.29')
+        # The unit gross price is rounded first (1.10)
+        self.assertTotals(compute_totals(positions, calculating_strategy="keep_gross"), '3.13', '0.17', '3.30')
+
+    def test_sum_strategies(self):
+        positions = [{'price_net': '0.13', 'tax': '20'}, {'price_net': '0.13', 'tax': '20'}]
+
+        self.assertTotals(compute_totals(positions, calculating_strategy={'sum': 'sum'}), '0.26', '0.06', '0.32')
+        self.assertTotals(compute_totals(positions, calculating_strategy={'sum': 'keep_net'}), '0.26', '0.05', '0.31')
+        self.assertTotals(compute_totals(positions, calculating_strategy={'sum': 'keep_gross'}), '0.27', '0.05', '0.32')
+
+    def test_gross_prices(self):
+        positions = [{'product_id': 1, 'quantity': '0,5'}]
+        totals = compute_totals(positions, [get_product(1, '10.0', '20', price_gross='24.0')],
+                                {'invoice_form_price_kind': 'gross'})
+        self.assertTotals(totals, '10.00', '2.00', '12.00')
+
+    def test_imposed_total_and_special_taxes(self):
+        positions = [{'price_net': '50', 'tax': '10', 'total_price_gross': 52.5},
+                     {'price_net': '-12.5', 'tax': 'disabled'}]
+        self.assertTotals(compute_totals(positions), '35.23', '4.77', '40.00')
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            get_strategy({'sum': 'average'})
+
+    @patch('vosfactures.models.get')
+    def test_products_are_loaded(self, mock_get):
+        default_cache.clear()
+        mock_get.return_value = dict(id=4, name="Product", price_net='100', tax='20')
+        invoice = Invoice._hydrate({'positions': [{'product_id': 4, 'quantity': 2}]})
+
+        self.assertTotals(invoice.compute_totals(), '200.00', '40.00', '240.00')
+        default_cache.clear()
+
+
+class ComputeTotalsBatchTest(TestCase):
+    def _get_quotes(self, count):
+        generator = random.Random(42)
+        return [[{'price_net': "{:.2f}".format(generator.uniform(-50, 1000)),
+                  'quantity': generator.choice([1, 2, '0.5', '1.25', 7]),
+                  'tax': generator.choice(['20', '10', '5.5', '2.1', 'disabled']),
+                  'price_gross': "{:.2f}".format(generator.uniform(0, 1000))}
+                 for _ in range(generator.randint(0, 6))]
+                for _ in range(count)]
+
+    def test_batch(self):
+        quotes = self._get_quotes(300)
+        for strategy in ({'position': 'default'}, {'position': 'keep_gross', 'sum': 'keep_net'},
+                         {'sum': 'keep_gross'}, {'invoice_form_price_kind': 'gross'}):
+            batch = compute_totals_batch(quotes, calculating_strategy=strategy)
+            expected = [compute_totals(positions, calculating_strategy=strategy)[:3] for positions in quotes]
+            self.assertEqual([totals[:3] for totals in batch], expected)
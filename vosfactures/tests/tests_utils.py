@@ -1,14 +1,16 @@
+import gzip
+import json
 from unittest.mock import patch, MagicMock
 
-from utils import get, delete, post, put, HttpError
+from utils import get, delete, post, put, download, get_session, DownloadError, HttpError
 
 from vosfactures.tests.base import BaseTestCase
 
 
 class QueryFunctionTest(BaseTestCase):
     def setUp(self):
-        self.patcher = patch('utils.requests')
-        self.mock_requests = self.patcher.start()
+        self.patcher = patch('utils.get_session')
+        self.mock_requests = self.patcher.start().return_value
         self.mock_requests.get = MagicMock()
         self.mock_requests.create = MagicMock()
         self.mock_requests.delete = MagicMock()
@@ -24,9 +26,9 @@ class QueryFunctionTest(BaseTestCase):
 
         get(json_page="some_page", action='some_action')
         self.mock_requests.get.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
 
     def test_url_without_instance(self):
@@ -36,9 +38,9 @@ class QueryFunctionTest(BaseTestCase):
 
         get(json_page="some_page", action='some_action')
         self.mock_requests.get.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
 
     def test_url_with_instance(self):
@@ -48,9 +50,21 @@ class QueryFunctionTest(BaseTestCase):
 
         get(json_page="some_page", action='some_action', instance_id=150)
         self.mock_requests.get.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page/150.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page/150.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
+        )
+
+    def test_with_params(self):
+        r = MagicMock(status_code=200)
+        r.json = MagicMock(return_value={})
+        self.mock_requests.get.return_value = r
+
+        get(json_page="some_page", action='some_action', params={'page': 2, 'per_page': 50})
+        self.mock_requests.get.assert_called_with(
+            url="https://testserver.vosfactures.fr/some_page.json?page=2&per_page=50&api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
 
     def test_with_data(self):
@@ -62,7 +76,7 @@ class QueryFunctionTest(BaseTestCase):
         self.mock_requests.get.assert_called_with(
             url="https://testserver.vosfactures.fr/some_page.json",
             headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {"some": "data"}}'
+            data='{"api_token":"anotsorandomapitoken","some_action":{"some":"data"}}'
         )
 
     def test_wrong_status_code(self):
@@ -80,9 +94,9 @@ class QueryFunctionTest(BaseTestCase):
 
         get(json_page="some_page", action='some_action')
         self.mock_requests.get.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
 
     def test_post(self):
@@ -92,9 +106,9 @@ class QueryFunctionTest(BaseTestCase):
 
         post(json_page="some_page", action='some_action')
         self.mock_requests.post.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
 
     def test_put(self):
@@ -106,7 +120,7 @@ class QueryFunctionTest(BaseTestCase):
         self.mock_requests.put.assert_called_with(
             url="https://testserver.vosfactures.fr/some_page.json",
             headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {"new_data": "here it is"}}'
+            data='{"api_token":"anotsorandomapitoken","some_action":{"new_data":"here it is"}}'
         )
 
     def test_delete(self):
@@ -116,7 +130,75 @@ class QueryFunctionTest(BaseTestCase):
 
         delete(json_page="some_page", action='some_action', instance_id=12345)
         self.mock_requests.delete.assert_called_with(
-            url="https://testserver.vosfactures.fr/some_page/12345.json",
-            headers={'Accept': 'application/json', 'Content-Type': 'application/json'},
-            data='{"api_token": "anotsorandomapitoken", "some_action": {}}'
+            url="https://testserver.vosfactures.fr/some_page/12345.json?api_token=anotsorandomapitoken",
+            headers={'Accept': 'application/json'},
+            data=None
         )
+
+    @patch('utils.COMPRESS_REQUESTS', True)
+    def test_compressed_body(self):
+        r = MagicMock(status_code=201)
+        r.json = MagicMock(return_value={})
+        self.mock_requests.post.return_value = r
+
+        post(json_page="some_page", action='some_action', description="a" * 2000)
+        kwargs = self.mock_requests.post.call_args[1]
+        self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+        self.assertLess(len(kwargs['data']), 200)
+        self.assertEqual(json.loads(gzip.decompress(kwargs['data'])), {
+            "api_token": "anotsorandomapitoken", "some_action": {"description": "a" * 2000}})
+
+        # The small bodies aren't worth it
+        post(json_page="some_page", action='some_action', description="a")
+        self.assertNotIn('Content-Encoding', self.mock_requests.post.call_args[1]['headers'])
+
+    def test_download(self):
+        r = MagicMock(status_code=200, headers={'Content-Length': '6'})
+        r.iter_content = MagicMock(return_value=iter([b'%PD', b'F-1']))
+        self.mock_requests.get.return_value = r
+
+        self.assertEqual(list(download("invoices", 12, "pdf", chunk_size=3)), [b'%PD', b'F-1'])
+        self.mock_requests.get.assert_called_with(
+            url="https://testserver.vosfactures.fr/invoices/12.pdf", params={'api_token': "anotsorandomapitoken"},
+            headers={'Accept-Encoding': 'identity'}, stream=True
+        )
+        r.iter_content.assert_called_with(chunk_size=3)
+        r.close.assert_called_with()
+
+    def test_encoded_download(self):
+        # The server can still compress the document : the decoded content is longer than the Content-Length
+        r = MagicMock(status_code=200, headers={'Content-Length': '4', 'Content-Encoding': 'gzip'})
+        r.iter_content = MagicMock(return_value=iter([b'%PDF-1', b'%PDF-1']))
+        self.mock_requests.get.return_value = r
+
+        self.assertEqual(b''.join(download("invoices", 12, "pdf")), b'%PDF-1%PDF-1')
+
+    def test_incomplete_download(self):
+        r = MagicMock(status_code=200, headers={'Content-Length': '10'})
+        r.iter_content = MagicMock(return_value=iter([b'%PDF-1']))
+        self.mock_requests.get.return_value = r
+
+        with self.assertRaises(DownloadError):
+            list(download("invoices", 12, "pdf"))
+
+    def test_download_wrong_status_code(self):
+        self.mock_requests.get.return_value = MagicMock(status_code=404)
+
+        with self.assertRaises(HttpError):
+            list(download("invoices", 12, "pdf"))
+
+
+class SessionTest(BaseTestCase):
+    @patch('utils._session', None)
+    def test_session_is_shared_and_retries(self):
+        session = get_session()
+        self.assertIs(get_session(), session)
+
+        adapter = session.get_adapter("https://testserver.vosfactures.fr/invoices.json")
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertTrue(adapter.max_retries.is_retry('GET', 503))
+        self.assertFalse(adapter.max_retries.is_retry('POST', 503))
+
+        # The responses can be compressed
+        self.assertIn("gzip", session.headers['Accept-Encoding'])
+        self.assertIn("deflate", session.headers['Accept-Encoding'])
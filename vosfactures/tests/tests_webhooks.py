@@ -0,0 +1,81 @@
+import asyncio
+import json
+from io import BytesIO
+
+from vosfactures.cache import ModelCache
+from vosfactures.models import Client, Invoice
+from vosfactures.tests.base import BaseTestCase
+from vosfactures.webhooks import WebhookError, WebhookReceiver
+
+
+class WebhookReceiverTest(BaseTestCase):
+    def setUp(self):
+        self.cache = ModelCache()
+        self.events = []
+        self.receiver = WebhookReceiver(cache=self.cache, listeners=[lambda *event: self.events.append(event)])
+
+    def _get_payload(self, kind, api_token="anotsorandomapitoken", **data):
+        model_name = kind.split(':')[0]
+        return json.dumps({'api_token': api_token, 'kind': kind, model_name: data}).encode()
+
+    def test_create(self):
+        event, invoice = self.receiver.handle(self._get_payload("invoice:create", id=5, number="2017-09"))
+
+        self.assertEqual(event, "create")
+        self.assertIsInstance(invoice, Invoice)
+        self.assertEqual(invoice.number, "2017-09")
+        self.assertIs(self.cache.get(Invoice, 5), invoice)
+        self.assertEqual(self.events, [("create", invoice)])
+
+    def test_update_in_place(self):
+        client = Client._hydrate({'id': 3, 'name': "Old name"})
+        self.cache.set(client)
+
+        self.receiver.handle(self._get_payload("client:update", id=3, name="New name"))
+        self.assertIs(self.cache.get(Client, 3), client)
+        self.assertEqual(client.name, "New name")
+
+    def test_delete(self):
+        self.cache.set(Client._hydrate({'id': 3, 'name': "Client"}))
+
+        self.receiver.handle(self._get_payload("client:delete", id=3))
+        self.assertIsNone(self.cache.get(Client, 3))
+
+    def test_wrong_token(self):
+        with self.assertRaises(WebhookError) as context:
+            self.receiver.handle(self._get_payload("client:create", api_token="wrong", id=3))
+        self.assertEqual(context.exception.status, 403)
+        self.assertEqual(self.events, [])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(WebhookError):
+            self.receiver.handle(self._get_payload("department:create", id=3))
+
+    def test_wsgi(self):
+        body = self._get_payload("product:update", id=1, name="Product")
+        environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': BytesIO(body)}
+        statuses = []
+
+        response = self.receiver.wsgi_app(environ, lambda status, headers: statuses.append(status))
+        self.assertEqual(statuses, ["200 OK"])
+        self.assertEqual(json.loads(b''.join(response)), {"status": "ok"})
+
+        environ = {'REQUEST_METHOD': 'GET', 'wsgi.input': BytesIO()}
+        self.receiver.wsgi_app(environ, lambda status, headers: statuses.append(status))
+        self.assertEqual(statuses[-1], "405 Method Not Allowed")
+
+    def test_asgi(self):
+        body = self._get_payload("client:update", api_token="wrong", id=1)
+        messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                    {'type': 'http.request', 'body': body[10:]}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.receiver.asgi_app({'type': 'http', 'method': 'POST'}, receive, send))
+        self.assertEqual(sent[0]['status'], 403)
+        self.assertEqual(self.cache.get(Client, 1), None)
@@ -0,0 +1,212 @@
+"""
+Local computation of the totals of invoices, following the rules of their calculating strategy, so that they can be
+previewed without creating the invoices.
+
+The amounts are computed exactly, with integers : the unit prices and quantities are read with 4 decimals, the tax
+rates with 2 (in percent), and every rounding to the cent is done half away from zero (like ROUND_HALF_UP).
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import lru_cache
+
+from vosfactures.models import CalculatingStrategy, Product
+
+PRICE_SCALE = 10 ** 4  # The prices are read in 1/10000
+QUANTITY_SCALE = 10 ** 4
+RATE_SCALE = 10 ** 2  # The tax rates (in percent) are read in 1/100, 5.5% being 550
+PERCENT = 100 * RATE_SCALE
+
+POSITION_STRATEGIES = ("default", "keep_gross")
+SUM_STRATEGIES = ("sum", "keep_gross", "keep_net")
+PRICE_KINDS = ("net", "gross")
+
+LineTotals = namedtuple('LineTotals', 'price_net price_tax price_gross')
+Totals = namedtuple('Totals', 'price_net price_tax price_gross lines')
+
+
+def get_strategy(calculating_strategy=None):
+    """
+    Returns the complete calculating strategy, as a dict with the "position", "sum" and "invoice_form_price_kind"
+    keys, from a partial dict or from the value of the position strategy only (like Invoice.calculating_strategy).
+    """
+    strategy = dict(position=CalculatingStrategy.position, sum=CalculatingStrategy.sum,
+                    invoice_form_price_kind=CalculatingStrategy.invoice_form_price_kind)
+    if isinstance(calculating_strategy, dict):
+        strategy.update(calculating_strategy)
+    elif calculating_strategy:
+        strategy['position'] = calculating_strategy
+
+    if strategy['position'] not in POSITION_STRATEGIES or strategy['sum'] not in SUM_STRATEGIES \
+            or strategy['invoice_form_price_kind'] not in PRICE_KINDS:
+        raise ValueError("Unknown calculating strategy : {}".format(strategy))
+    return strategy
+
+
+@lru_cache(maxsize=4096)
+def to_scaled(value, scale):
+    """
+    Returns the integer value of a number (or of its text, with a dot or a comma) in 1/scale units. The prices, rates
+    and quantities being often the same, the values are cached.
+    """
+    try:
+        number = Decimal(str(value).replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError("{!r} is not a number".format(value))
+    return int((number * scale).to_integral_value(ROUND_HALF_UP))
+
+
+def get_rate(tax):
+    # The taxes that aren't rates ("disabled", "np", "zw"...) have no amount
+    try:
+        return to_scaled(tax, RATE_SCALE)
+    except ValueError:
+        return 0
+
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def round_div(numerator, denominator):
+    """
+    Returns numerator / denominator rounded half away from zero, for positive denominators.
+    """
+    quotient = (abs(numerator) * 2 + denominator) // (denominator * 2)
+    return -quotient if numerator < 0 else quotient
+
+
+def compute_line(price, quantity, rate, total_gross, strategy):
+    """
+    Returns the net, tax and gross amounts (in cents) of a line, from its unit price, quantity and rate (see the
+    scales above) and its total gross price in cents (None when it's not imposed).
+    """
+    factor = PERCENT + rate
+    if total_gross is not None:
+        gross = total_gross
+    elif strategy['invoice_form_price_kind'] == "gross":
+        gross = round_div(price * quantity, PRICE_SCALE * QUANTITY_SCALE // 100)
+    elif strategy['position'] == "keep_gross":
+        # The unit gross price is rounded first, then multiplied by the quantity
+        unit_gross = round_div(price * factor, PERCENT * PRICE_SCALE // 100)
+        gross = round_div(unit_gross * quantity, QUANTITY_SCALE)
+    else:
+        net = round_div(price * quantity, PRICE_SCALE * QUANTITY_SCALE // 100)
+        tax = round_div(net * rate, PERCENT)
+        return net, tax, net + tax
+
+    net = round_div(gross * PERCENT, factor)
+    return net, gross - net, gross
+
+
+def compute_sums(net, gross, rate, strategy):
+    """
+    Returns the net, tax and gross amounts of a group of lines having the same rate, from the sums of their net and
+    gross amounts.
+    """
+    if strategy['sum'] == "keep_net":
+        tax = round_div(net * rate, PERCENT)
+        return net, tax, net + tax
+
+    if strategy['sum'] == "keep_gross":
+        net = round_div(gross * PERCENT, PERCENT + rate)
+
+    return net, gross - net, gross
+
+
+def read_position(position, products, price_kind):
+    """
+    Returns the unit price, quantity, rate and imposed total gross price (or None) of a position, as integers. The
+    values missing from the position are taken from its product.
+    """
+    product = products.get(position.get('product_id'))
+
+    def get_value(name):
+        value = position.get(name)
+        if value is None and product is not None:
+            value = getattr(product, name, None)
+        return value
+
+    price = get_value('price_{}'.format(price_kind))
+    if price is None:
+        raise ValueError("The position {} has no {} unit price".format(position, price_kind))
+
+    total_gross = position.get('total_price_gross')
+    return (to_scaled(price, PRICE_SCALE), to_scaled(position.get('quantity', 1), QUANTITY_SCALE),
+            get_rate(get_value('tax')), None if total_gross is None else to_scaled(total_gross, 100))
+
+
+def get_products(quotes, products=None):
+    """
+    Returns a dict of the products of the positions by id, loading the ones that aren't given (through the cache).
+    """
+    if products is None:
+        products = {}
+    elif not isinstance(products, dict):
+        products = {product.id: product for product in products}
+
+    missing = {position.get('product_id') for positions in quotes for position in positions} - set(products)
+    missing.discard(None)
+    if missing:
+        products = dict(products)
+        products.update(Product.get_many(missing))
+    return products
+
+
+def compute_totals(positions, products=None, calculating_strategy=None):
+    """
+    Returns the Totals of an invoice, with the LineTotals of each of its positions.
+    :param positions: the positions of the invoice, like Invoice.positions
+    :param products: the products of the positions (a dict by id or an iterable), loaded through the cache if missing
+    :param calculating_strategy: a calculating strategy, as accepted by get_strategy()
+    """
+    strategy = get_strategy(calculating_strategy)
+    products = get_products([positions], products)
+
+    lines = []
+    groups = {}
+    for position in positions:
+        price, quantity, rate, total_gross = read_position(position, products, strategy['invoice_form_price_kind'])
+        net, tax, gross = compute_line(price, quantity, rate, total_gross, strategy)
+        lines.append(LineTotals(from_cents(net), from_cents(tax), from_cents(gross)))
+        group = groups.setdefault(rate, [0, 0])
+        group[0] += net
+        group[1] += gross
+
+    total_net = total_tax = total_gross = 0
+    for rate, (net, gross) in groups.items():
+        net, tax, gross = compute_sums(net, gross, rate, strategy)
+        total_net += net
+        total_tax += tax
+        total_gross += gross
+
+    return Totals(from_cents(total_net), from_cents(total_tax), from_cents(total_gross), lines)
+
+
+def compute_totals_batch(quotes, products=None, calculating_strategy=None):
+    """
+    Returns the Totals (without the lines) of many invoices at once, sharing the same calculating strategy, and
+    loading all their missing products at once.
+    :param quotes: a list of positions lists
+    """
+    strategy = get_strategy(calculating_strategy)
+    products = get_products(quotes, products)
+
+    price_kind = strategy['invoice_form_price_kind']
+    rows = [(index,) + read_position(position, products, price_kind)
+            for index, positions in enumerate(quotes) for position in positions]
+
+    sums = [{} for _ in quotes]
+    for index, price, quantity, rate, total_gross in rows:
+        net, _, gross = compute_line(price, quantity, rate, total_gross, strategy)
+        group = sums[index].setdefault(rate, [0, 0])
+        group[0] += net
+        group[1] += gross
+
+    totals = []
+    for groups in sums:
+        total = [0, 0, 0]
+        for rate, (net, gross) in groups.items():
+            for i, amount in enumerate(compute_sums(net, gross, rate, strategy)):
+                total[i] += amount
+        totals.append(Totals(from_cents(total[0]), from_cents(total[1]), from_cents(total[2]), None))
+    return totals
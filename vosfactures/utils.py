@@ -1,14 +1,76 @@
+import gzip
 import json
-
-import requests
+from urllib.parse import urlencode
 
 from vosfactures import settings
 
+# Imported on first use (see get_requests()), as it makes the import of the package several times slower
+requests = None
+
+# The connections are kept alive and shared by all the queries (and threads), see get_session()
+POOL_SIZE = 20
+# Failed connections and temporary server errors are retried for the idempotent methods (not POST)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+# The bodies of the POST and PUT queries can be sent compressed, if the server accepts it
+COMPRESS_REQUESTS = False
+COMPRESS_MIN_SIZE = 1024
+
+_session = None
+
 
 class HttpError(Exception):
     pass
 
 
+class DownloadError(HttpError):
+    pass
+
+
+def get_requests():
+    global requests
+    if requests is None:
+        import requests as requests_module
+        requests = requests_module
+    return requests
+
+
+def get_session():
+    """
+    Returns the HTTP session used by all the queries, which keeps a pool of connections to the API.
+    """
+    global _session
+    if _session is None:
+        http = get_requests()
+        retries = http.adapters.Retry(
+            total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = http.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+        session = http.Session()
+        session.headers['Accept-Encoding'] = get_accept_encoding()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session = session
+    return _session
+
+
+def get_accept_encoding():
+    """
+    Returns the compressions of the responses that can be decoded : gzip and deflate, and brotli if one of the brotli
+    packages is installed.
+    """
+    encodings = ["gzip", "deflate"]
+    for module in ("brotli", "brotlicffi"):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        encodings.append("br")
+        break
+    return ", ".join(encodings)
+
+
 def get(**kwargs):
     return query(method="GET", **kwargs)
 
@@ -25,34 +87,75 @@ def put(**kwargs):
     return query(method="PUT", **kwargs)
 
 
-def query(json_page=None, action=None, instance_id=None, method="GET", **kwargs):
+def query(json_page=None, action=None, instance_id=None, method="GET", params=None, **kwargs):
     if instance_id is None:
         url = "https://{}/{}.json".format(settings.HOST, json_page)
     else:
         url = "https://{}/{}/{}.json".format(settings.HOST, json_page, instance_id)
 
+    headers = {'Accept': 'application/json'}
+    data = None
+    if not kwargs:
+        # Without any data (like for the GET and DELETE queries), the token is given in the query string and no body
+        # is sent
+        params = dict(params or {}, api_token=settings.API_TOKEN)
+    else:
+        # Creating the passed data as compact json
+        data = json.dumps({"api_token": settings.API_TOKEN, action: kwargs}, separators=(',', ':'))
+        headers['Content-Type'] = 'application/json'
+        if COMPRESS_REQUESTS and method in ("POST", "PUT") and len(data) >= COMPRESS_MIN_SIZE:
+            data = gzip.compress(data.encode())
+            headers['Content-Encoding'] = 'gzip'
+
+    if params:
+        # Filters and pagination are given in the query string
+        url = "{}?{}".format(url, urlencode(params))
+
+    http = get_session()
     if method == "GET":
-        req_method = requests.get
+        req_method = http.get
     elif method == "POST":
-        req_method = requests.post
+        req_method = http.post
     elif method == "DELETE":
-        req_method = requests.delete
+        req_method = http.delete
     elif method == "PUT":
-        req_method = requests.put
-
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-    }
-
-    # Creating the passed data as json
-    data = json.dumps({"api_token": settings.API_TOKEN, action: kwargs})
+        req_method = http.put
 
     response = req_method(url=url, headers=headers, data=data)
 
-    right_responses = {'GET': [200, 204, 205], 'POST': [201], 'DELETE': [200], 'PUT': [200]}
+    right_responses = {'GET': [200, 204, 205], 'POST': [200, 201], 'DELETE': [200], 'PUT': [200]}
     if response.status_code in right_responses[method]:
         return response.json()
 
     error_msg = "Error {} during the query process for {} ({}). Data : {}, response : {}"
     raise HttpError(error_msg.format(response.status_code, url, method, data, response.json()))
+
+
+def download(json_page, instance_id, extension, chunk_size=CHUNK_SIZE):
+    """
+    Yields the content of a document (like "invoices/12.pdf") in chunks, without loading it in memory.
+    :raise DownloadError: if the document is shorter than announced by the server
+    """
+    url = "https://{}/{}/{}.{}".format(settings.HOST, json_page, instance_id, extension)
+    # The documents (like PDFs) are already compressed, and their size can only be checked if they aren't encoded
+    response = get_session().get(url=url, params={"api_token": settings.API_TOKEN},
+                                 headers={'Accept-Encoding': 'identity'}, stream=True)
+
+    try:
+        if response.status_code != 200:
+            error_msg = "Error {} during the download of {}"
+            raise HttpError(error_msg.format(response.status_code, url))
+
+        size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+            yield chunk
+
+        # The Content-Length of an encoded response is the size of the encoded content
+        expected_size = response.headers.get('Content-Length')
+        encoded = response.headers.get('Content-Encoding', 'identity') != 'identity'
+        if expected_size is not None and not encoded and size != int(expected_size):
+            error_msg = "The download of {} is incomplete ({} bytes received out of {})"
+            raise DownloadError(error_msg.format(url, size, expected_size))
+    finally:
+        response.close()
@@ -0,0 +1,148 @@
+import hmac
+import json
+
+from vosfactures import settings
+from vosfactures.cache import default_cache
+from vosfactures.models import Client, Invoice, Product
+
+# The models of the objects sent by the webhooks, by the name used in their "kind" ("invoice:update")
+WEBHOOK_MODELS = {
+    'invoice': Invoice,
+    'client': Client,
+    'product': Product,
+}
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+
+class WebhookError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class WebhookReceiver:
+    """
+    Receives the webhooks of VosFactures, and keeps the cache and the mirrors (any callable registered as a listener)
+    up to date with the objects they contain, instead of polling the list queries. It can be served as a WSGI or an
+    ASGI application, or as a django view.
+    """
+
+    def __init__(self, api_token=None, cache=default_cache, listeners=()):
+        """
+        :param api_token: the token the webhooks must contain. By default, the API token of the settings.
+        :param cache: the ModelCache to update, or None
+        :param listeners: some callables, called with the event ("create", "update" or "delete") and the instance
+        """
+        self.api_token = api_token
+        self.cache = cache
+        self.listeners = list(listeners)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def handle(self, payload):
+        """
+        Applies a webhook to the cache and the listeners.
+        :param payload: the body of the webhook, as bytes, str or an already decoded dict
+        :return: the event and the instance built from the webhook
+        :raise WebhookError: if the webhook is invalid or isn't signed with the right token
+        """
+        if isinstance(payload, (bytes, str)):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                raise WebhookError("The webhook isn't valid JSON")
+
+        if not isinstance(payload, dict):
+            raise WebhookError("The webhook should be a JSON object")
+
+        expected_token = self.api_token if self.api_token is not None else settings.API_TOKEN
+        if not hmac.compare_digest(str(payload.get('api_token', '')), str(expected_token)):
+            raise WebhookError("Wrong API token", status=403)
+
+        model_name, _, event = str(payload.get('kind', '')).partition(':')
+        model = WEBHOOK_MODELS.get(model_name)
+        data = payload.get(model_name)
+        if model is None or event not in (CREATE, UPDATE, DELETE) or not isinstance(data, dict):
+            raise WebhookError('Unknown webhook "{}"'.format(payload.get('kind')))
+
+        instance = model()
+        instance._set_data(**data)
+        if instance.id is None:
+            raise WebhookError("The {} of the webhook has no id".format(model_name))
+
+        if self.cache is not None:
+            cached = self.cache.get(model, instance.id)
+            if event == DELETE:
+                self.cache.invalidate(model, instance.id)
+            elif cached is not None and not cached.is_deleted():
+                # The instances already in use (like the ones of the invoices' relationships) are updated in place
+                cached._set_data(**data)
+            else:
+                self.cache.set(instance)
+
+        for listener in self.listeners:
+            listener(event, instance)
+
+        return event, instance
+
+    def _respond(self, body):
+        try:
+            self.handle(body)
+        except WebhookError as e:
+            return e.status, json.dumps({"error": str(e)}).encode()
+        return 200, b'{"status": "ok"}'
+
+    def wsgi_app(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            status, body = 405, b'{"error": "Method not allowed"}'
+        else:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            status, body = self._respond(environ['wsgi.input'].read(length))
+
+        reasons = {200: "OK", 400: "Bad Request", 403: "Forbidden", 405: "Method Not Allowed"}
+        start_response("{} {}".format(status, reasons[status]),
+                       [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    async def asgi_app(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        if scope['method'] != 'POST':
+            status, body = 405, b'{"error": "Method not allowed"}'
+        else:
+            chunks = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                chunks.append(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            status, body = self._respond(b''.join(chunks))
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def django_view(self):
+        """
+        Returns a django view receiving the webhooks, to be added to the urls of the project.
+        """
+        from django.http import HttpResponse
+        from django.views.decorators.csrf import csrf_exempt
+
+        @csrf_exempt
+        def view(request):
+            if request.method != 'POST':
+                status, body = 405, b'{"error": "Method not allowed"}'
+            else:
+                status, body = self._respond(request.body)
+            return HttpResponse(body, status=status, content_type='application/json')
+
+        return view